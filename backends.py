@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import google.generativeai as genai
+
+from llm_cache import CachedModel, CachedResponse
+from ratelimit import ResilientModel
+
+
+# what the model library raises for a blocked response: response.text raises ValueError for a
+# candidate stopped for safety or another reason, and streams raise the two exceptions below.
+# Anything else, like a network error, is a failure of its own and not a safety block
+BLOCKED_RESPONSE_ERRORS = (ValueError, genai.types.BlockedPromptException, genai.types.StopCandidateException)
+
+# the stages that call a model, each can run on its own backend
+STAGES = ["extract", "compare", "group"]
+
+# extraction and grouping are simple enough for the flash tier, the comparison needs pro
+DEFAULT_STAGE_MODELS = {
+    "extract": "gemini-1.5-flash-latest",
+    "compare": "gemini-1.5-pro-latest",
+    "group": "gemini-1.5-flash-latest",
+}
+
+REPLAY_BACKEND = "replay"
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_NONE"
+    },
+]
+
+
+class MissingRecordingError(LookupError):
+    pass
+
+
+# builds the model stack used by every call site: response cache -> rate limiter and retries -> gemini
+def build_gemini_model(api_key, temperature, tokens, limiter=None, breaker=None, cache=None, model_name="gemini-1.5-pro-latest"):
+    genai.configure(api_key=api_key)
+
+    # Set up the model
+    generation_config = {
+        "temperature": temperature,
+        "max_output_tokens": tokens,
+    }
+
+    model = genai.GenerativeModel(model_name=model_name,
+                                  generation_config=generation_config,
+                                  safety_settings=SAFETY_SETTINGS)
+    model = ResilientModel(model, limiter=limiter, breaker=breaker, max_output_tokens=tokens)
+    if cache is not None:
+        model = CachedModel(model, cache, model_name, generation_config)
+    return model
+
+
+# recordings are keyed on the prompt only, so a recording replays whatever model produced it
+def prompt_key(prompt_parts):
+    payload = json.dumps([str(part) for part in prompt_parts])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_recordings(path):
+    recordings = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recordings[record["key"]] = record["text"]
+    return recordings
+
+
+# offline backend that answers every prompt with the response recorded for it, after a simulated
+# latency of latency seconds plus a uniform jitter, so the pipeline runs without network access
+class ReplayModel:
+    def __init__(self, path, latency=0.0, jitter=0.0, seed=None):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.recordings = load_recordings(path)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt_parts, **kwargs):
+        key = prompt_key(prompt_parts)
+        if key not in self.recordings:
+            raise MissingRecordingError(f"no response recorded in {self.path} for prompt {key}")
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        text = self.recordings[key]
+        if kwargs.get("stream"):
+            return [CachedResponse(line) for line in text.splitlines(keepends=True)] or [CachedResponse("")]
+        return CachedResponse(text)
+
+
+# wraps a model and appends every prompt and response it sees to a JSONL file that ReplayModel reads
+class RecordingModel:
+    def __init__(self, model, path, model_name=None):
+        self.model = model
+        self.path = path
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def generate_content(self, prompt_parts, **kwargs):
+        key = prompt_key(prompt_parts)
+        response = self.model.generate_content(prompt_parts, **kwargs)
+        if kwargs.get("stream"):
+            return self._stream_and_record(key, response)
+        try:
+            text = response.text
+        except Exception:
+            return response
+        self.record(key, text)
+        return response
+
+    def _stream_and_record(self, key, response):
+        chunks = []
+        for chunk in response:
+            chunks.append(chunk.text)
+            yield chunk
+        self.record(key, "".join(chunks))
+
+    def record(self, key, text):
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"key": key, "model": self.model_name, "text": text}) + "\n")
+
+
+# builds one model per stage from a {stage: model name} mapping, stages that use the same
+# model share one instance. The name "replay" selects the offline ReplayModel
+def build_stage_models(stage_models, api_key=None, temperature=1.0, tokens=4000, limiter=None, breaker=None,
+                       cache=None, replay_path=None, replay_latency=0.0, replay_jitter=0.0, record_path=None):
+    models = {}
+    built = {}
+    for stage in STAGES:
+        model_name = stage_models.get(stage, DEFAULT_STAGE_MODELS[stage])
+        if model_name not in built:
+            if model_name == REPLAY_BACKEND:
+                if not replay_path:
+                    raise ValueError("the replay backend needs a file of recorded responses")
+                model = ReplayModel(replay_path, replay_latency, replay_jitter)
+            else:
+                model = build_gemini_model(api_key, temperature, tokens, limiter=limiter, breaker=breaker,
+                                           cache=cache, model_name=model_name)
+                if record_path:
+                    model = RecordingModel(model, record_path, model_name)
+            built[model_name] = model
+        models[stage] = built[model_name]
+    return models
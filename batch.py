@@ -0,0 +1,454 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+from demo import (extract_descriptive_details_from_reviews, clean_descriptive_details, EXTRACTION_PROMPT_VERSION,
+                  compare_distinct_details, COMPARISON_PROMPT_VERSION, merge_tables, group_attributes, group_attributes_combined, combined_attribute_list,
+                  extract_grouped_attributes, split_tables)
+from llm_cache import ResponseCache, DEFAULT_CACHE_PATH
+from backends import DEFAULT_STAGE_MODELS, REPLAY_BACKEND, build_stage_models
+from ratelimit import RateLimiter, CircuitBreaker
+from category_index import CategoryIndex, DEFAULT_INDEX_PATH
+from canonicalize import SynonymTable, DEFAULT_SYNONYMS_PATH, canonicalize_descriptive_details
+from dedup import find_duplicate_reviews
+from review_reader import review_text
+from metrics import Metrics, instrument_models
+from result_store import ResultStore, DEFAULT_STORE_PATH, review_hash, config_key
+
+
+TABLE_NAMES = ["missing", "contradictory", "partially_matching"]
+MERGED_COLUMNS = ["Attribute", "Value", "Review number"]
+
+
+def read_products(path):
+    # stream the input so tens of thousands of products never sit in memory at once
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                product = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: {e}", file=sys.stderr)
+                continue
+            yield product
+
+
+def review_texts(reviews, product_id=None):
+    # a malformed review is reported and skipped instead of failing the whole product
+    texts = []
+    for number, entry in enumerate(reviews, start=1):
+        try:
+            texts.append(review_text(entry))
+        except ValueError as e:
+            print(f"Skipping review {number} of product {product_id}: {e}", file=sys.stderr)
+    return texts
+
+
+def to_records(table):
+    return table.to_dict(orient="records")
+
+
+# digest of the inputs of a product, a product that got new reviews or a new description
+# since its last run gets fresh checkpoints instead of counting as done
+def product_fingerprint(product):
+    payload = json.dumps([product.get("description", ""), product.get("vertical"), product.get("reviews", [])],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# every stage result of a product is stored as its own json file, so a crashed
+# or throttled run restarts from the last finished stage instead of redoing llm work
+class Checkpoints:
+    def __init__(self, directory, product_id, fingerprint=None):
+        safe_id = re.sub(r"[^A-Za-z0-9._-]", "_", str(product_id))
+        self.product_directory = os.path.join(directory, safe_id)
+        self.directory = self.product_directory
+        if fingerprint is not None:
+            self.directory = os.path.join(self.directory, fingerprint)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, stage):
+        return os.path.join(self.directory, f"{stage}.json")
+
+    def load(self, stage):
+        try:
+            with open(self.path(stage), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, stage, result):
+        # one temporary file per process, two workers may run the same product at once
+        temporary_path = f"{self.path(stage)}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(temporary_path, self.path(stage))
+
+    def is_done(self):
+        return os.path.exists(self.path("done"))
+
+    # removes the checkpoints of every version of the product
+    def remove(self):
+        shutil.rmtree(self.product_directory, ignore_errors=True)
+
+
+def run_stage(checkpoints, stage, compute, metrics=None):
+    result = checkpoints.load(stage)
+    if result is None:
+        # only computed stages are timed, a stage restored from its checkpoint costs nothing
+        if metrics is None:
+            result = compute()
+        else:
+            with metrics.timed(stage):
+                result = compute()
+        checkpoints.save(stage, result)
+    return result
+
+
+# the {model, temperature, max_tokens} of a stage, as the demo records it for each stage
+def stage_model_config(args, stage):
+    return {"model": getattr(args, f"{stage}_model"), "temperature": args.temperature, "max_tokens": args.max_tokens}
+
+
+def process_product(product, models, args, category_index=None, synonyms=None, metrics=None, store=None):
+    if metrics is None:
+        metrics = Metrics()
+    models = instrument_models(models, metrics)
+    product_id = product["product_id"]
+    description = product.get("description", "")
+    vertical = str(product.get("vertical") or "").strip().lower()
+    reviews = review_texts(product.get("reviews", []), product_id)
+    checkpoints = Checkpoints(args.checkpoint_dir, product_id, product_fingerprint(product))
+
+    # reviews extracted in an earlier run keep their stored details, only the new ones are
+    # deduplicated and extracted, so a refresh costs in proportion to the new reviews
+    hashes = [review_hash(review) for review in reviews]
+    stored_details = {}
+    if store is not None:
+        extract_config = config_key(stage_model_config(args, "extract"), EXTRACTION_PROMPT_VERSION,
+                                    batched=not args.no_batching)
+        stored_details = store.get_extractions(product_id, extract_config)
+    unseen = [i for i, key in enumerate(hashes) if key not in stored_details]
+
+    # the clusters map the hash of every unseen review to the hash of its representative. Positions
+    # in unseen would not survive a resume, a run stopped after the extractions were stored
+    # finds fewer unseen reviews
+    def cluster():
+        representatives, assignments = find_duplicate_reviews([reviews[i] for i in unseen], args.dedup_threshold)
+        return {hashes[unseen[i]]: hashes[unseen[representatives[number]]] for i, number in enumerate(assignments)}
+
+    representative_of = {} if args.no_dedup else run_stage(checkpoints, "dedup", cluster, metrics)
+
+    # only one review per cluster of near duplicates goes to the model, the results are
+    # copied back to every review so the merged review numbers and counts stay correct
+    def extract():
+        unseen_hashes = [hashes[i] for i in unseen]
+        representatives = list(dict.fromkeys(
+            representative_of.get(key, key) for key in unseen_hashes))
+        representatives = [key for key in representatives if key not in stored_details]
+        details = {}
+        if representatives:
+            texts = dict(zip(hashes, reviews))
+            extracted = extract_descriptive_details_from_reviews(
+                [texts[key] for key in representatives], model=models["extract"], concurrency=args.concurrency,
+                batched=not args.no_batching, max_output_tokens=args.max_tokens,
+                on_parse_failure=lambda count: metrics.add("extract", "parse_failures", count))
+            if extracted == "Safety Error!":
+                raise RuntimeError("Safety Error! in extraction")
+            details = dict(zip(representatives, clean_descriptive_details(extracted)))
+        details = {**stored_details, **details}
+        new_details = {key: details[representative_of.get(key, key)] for key in unseen_hashes}
+        if store is not None and new_details:
+            store.put_extractions(product_id, extract_config, new_details)
+        stored_details.update(new_details)
+        return [stored_details[key] for key in hashes]
+
+    descriptive_details = run_stage(checkpoints, "extract", extract, metrics)
+
+    if not args.no_canonicalize:
+        canonicalized = run_stage(checkpoints, "canonicalize", lambda: dict(zip(
+            ["descriptive_details", "audit_trail"], canonicalize_descriptive_details(descriptive_details, synonyms))),
+            metrics)
+        descriptive_details = canonicalized["descriptive_details"]
+
+    # reviews with the same details are compared once, and details already compared with this
+    # description in an earlier run are reused. A new description finds no stored tables
+    def compare():
+        stored_tables = None
+        if store is not None:
+            compare_config = config_key(stage_model_config(args, "compare"), COMPARISON_PROMPT_VERSION,
+                                        prematch=not args.no_prematch)
+            stored_tables = store.get_comparisons(product_id, description, compare_config)
+        review_tables, new_tables = compare_distinct_details(
+            description, descriptive_details, stored_tables, model=models["compare"], concurrency=args.concurrency,
+            max_output_tokens=args.max_tokens, repair_attempts=args.repair_attempts, prematch=not args.no_prematch,
+            on_parse_failure=lambda count: metrics.add("compare", "parse_failures", count))
+        if review_tables == "Safety Error!":
+            raise RuntimeError("Safety Error! in comparison")
+        if store is not None and new_tables:
+            store.put_comparisons(product_id, description, compare_config, new_tables)
+        return review_tables
+
+    review_tables = run_stage(checkpoints, "compare", compare, metrics)
+
+    def merge():
+        *tables, error_log = merge_tables(review_tables)
+        merged = {name: to_records(table)
+                  for name, table in zip(TABLE_NAMES, tables)}
+        merged["error_log"] = error_log
+        metrics.add("merge", "parse_failures", len(error_log))
+        return merged
+
+    merged = run_stage(checkpoints, "merge", merge, metrics)
+    merged_tables = {name: pd.DataFrame(merged[name], columns=MERGED_COLUMNS)
+                     for name in TABLE_NAMES}
+
+    def group():
+        if args.separate_grouping:
+            return {name: group_attributes(merged_tables[name], model=models["group"], vertical=vertical, category_index=category_index)
+                    for name in TABLE_NAMES}
+        return {"combined": group_attributes_combined(
+            list(merged_tables.values()), model=models["group"], vertical=vertical, category_index=category_index,
+            concurrency=args.concurrency, max_output_tokens=args.max_tokens)}
+
+    grouped = run_stage(checkpoints, "group", group, metrics)
+
+    def split():
+        result = {}
+        for name in TABLE_NAMES:
+            if "combined" in grouped:
+                response = grouped["combined"]
+                attributes = combined_attribute_list(merged_tables.values())
+            else:
+                response = grouped[name]
+                attributes = list(merged_tables[name]["Attribute"])
+            category_dict, explanation, errored = extract_grouped_attributes(
+                response, vertical=vertical, attributes=attributes, category_index=category_index)
+            if errored:
+                metrics.add("group", "parse_failures")
+            tables = {} if errored else split_tables(
+                merged_tables[name], category_dict)
+            result[name] = {
+                "categories": category_dict,
+                "explanation": explanation,
+                "errored": errored,
+                "tables": {category: to_records(table) for category, table in tables.items() if not table.empty},
+            }
+        return result
+
+    split_result = run_stage(checkpoints, "split", split, metrics)
+
+    return {
+        "product_id": product_id,
+        "descriptive_details": descriptive_details,
+        "review_tables": review_tables,
+        "merged": merged,
+        "grouped": split_result,
+    }
+
+
+# the stage models and the persistent state process_product needs, built from the pipeline arguments
+def build_pipeline(args):
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    breaker = CircuitBreaker()
+    cache = None if args.no_cache else ResponseCache(args.cache_path)
+    models = build_stage_models({"extract": args.extract_model, "compare": args.compare_model, "group": args.group_model},
+                                args.api_key, args.temperature, args.max_tokens, limiter=limiter, breaker=breaker,
+                                cache=cache, replay_path=args.replay, replay_latency=args.replay_latency,
+                                replay_jitter=args.replay_jitter, record_path=args.record)
+    category_index = CategoryIndex(args.category_index)
+    synonyms = SynonymTable(args.synonyms)
+    store = None if args.no_store else ResultStore(args.store_path)
+    return models, category_index, synonyms, store
+
+
+# (product id, fingerprint) of every result already in the output. A crash between writing
+# a result and its done checkpoint would otherwise append the product again on resume
+def resume_output(path):
+    written = set()
+    line = "\n"
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a run that crashed while writing it
+                    continue
+                written.add((result.get("product_id"), result.get("fingerprint")))
+    except FileNotFoundError:
+        pass
+    # a line cut short by a crash is ended, so the next result starts on its own line
+    if not line.endswith("\n"):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n")
+    return written
+
+
+def run_batch(args):
+    models, category_index, synonyms, store = build_pipeline(args)
+    written = resume_output(args.output)
+
+    output_lock = threading.Lock()
+    processed = failed = skipped = 0
+    run_metrics = Metrics()
+    metrics_output = open(args.metrics, "a", encoding="utf-8") if args.metrics else None
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        def handle(product):
+            metrics = Metrics()
+            fingerprint = product_fingerprint(product)
+            try:
+                result = process_product(product, models, args, category_index, synonyms, metrics, store)
+                with output_lock:
+                    output.write(json.dumps(dict(result, fingerprint=fingerprint)) + "\n")
+                    output.flush()
+                Checkpoints(args.checkpoint_dir, product["product_id"], fingerprint).save("done", True)
+            finally:
+                # failed products are measured too, their retries and errors are often the interesting part
+                run_metrics.merge(metrics)
+                if metrics_output is not None:
+                    with output_lock:
+                        for record in metrics.records(product_id=product["product_id"]):
+                            metrics_output.write(json.dumps(record) + "\n")
+                        metrics_output.flush()
+
+        # keep a bounded number of products in flight so the input is consumed lazily
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            in_flight = {}
+            for product in read_products(args.input):
+                if "product_id" not in product:
+                    print("Skipping a record without product_id", file=sys.stderr)
+                    continue
+                checkpoints = Checkpoints(args.checkpoint_dir, product["product_id"], product_fingerprint(product))
+                if (product["product_id"], product_fingerprint(product)) in written and not checkpoints.is_done():
+                    checkpoints.save("done", True)
+                if checkpoints.is_done():
+                    skipped += 1
+                    continue
+                if len(in_flight) >= args.workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        processed, failed = collect(
+                            future, in_flight.pop(future), processed, failed)
+                in_flight[executor.submit(handle, product)] = product["product_id"]
+
+            for future in list(in_flight):
+                processed, failed = collect(
+                    future, in_flight.pop(future), processed, failed)
+
+    if metrics_output is not None:
+        metrics_output.close()
+    if args.prometheus:
+        with open(args.prometheus, "w", encoding="utf-8") as f:
+            f.write(run_metrics.to_prometheus())
+    print(format_metrics(run_metrics), file=sys.stderr)
+    print(f"Processed {processed} products, {failed} failed, {skipped} already done", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def format_metrics(metrics):
+    lines = []
+    for stage, values in metrics.snapshot().items():
+        lines.append(f"{stage}: {values['seconds']:.1f}s, {values['calls']} calls, {values['prompt_tokens']} prompt and "
+                     f"{values['output_tokens']} output tokens, {values['retries']} retries, {values['cache_hits']} cache hits, "
+                     f"{values['parse_failures']} parse failures")
+    return "\n".join(lines)
+
+
+def collect(future, product_id, processed, failed):
+    try:
+        future.result()
+        return processed + 1, failed
+    except Exception as e:
+        # the finished stages stay checkpointed, rerunning the batch resumes from them
+        print(f"Product {product_id} failed: {e}", file=sys.stderr)
+        return processed, failed + 1
+
+
+# the model, quota and pipeline options shared by the batch runner and the service
+def add_pipeline_arguments(parser):
+    parser.add_argument("--checkpoint-dir", default=".praise_checkpoints",
+                        help="directory holding the per product stage checkpoints")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"),
+                        help="Gemini API key, defaults to $GOOGLE_API_KEY")
+    parser.add_argument("--extract-model", default=DEFAULT_STAGE_MODELS["extract"],
+                        help=f"model used for the extraction, {REPLAY_BACKEND!r} replays recorded responses")
+    parser.add_argument("--compare-model", default=DEFAULT_STAGE_MODELS["compare"],
+                        help="model used for the comparison with the seller description")
+    parser.add_argument("--group-model", default=DEFAULT_STAGE_MODELS["group"],
+                        help="model used for the grouping of the attributes")
+    parser.add_argument("--replay", help="JSONL file of recorded responses used by the replay backend")
+    parser.add_argument("--replay-latency", type=float, default=0.0,
+                        help="seconds each replayed response takes")
+    parser.add_argument("--replay-jitter", type=float, default=0.0,
+                        help="maximum random seconds added to each replayed response")
+    parser.add_argument("--record", help="JSONL file every model response is appended to, for later replay")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="number of concurrent model calls per product")
+    parser.add_argument("--repair-attempts", type=int, default=2)
+    parser.add_argument("--requests-per-minute", type=int, default=60)
+    parser.add_argument("--tokens-per-minute", type=int, default=1000000)
+    parser.add_argument("--no-batching", action="store_true",
+                        help="send one review per extraction request")
+    parser.add_argument("--separate-grouping", action="store_true",
+                        help="group the attributes of each merged table in its own request")
+    parser.add_argument("--no-canonicalize", action="store_true",
+                        help="keep the extracted attribute names as they are")
+    parser.add_argument("--synonyms", default=DEFAULT_SYNONYMS_PATH,
+                        help="JSON file with the learned attribute synonyms")
+    parser.add_argument("--no-prematch", action="store_true",
+                        help="send every attribute-value pair to the model in the comparison")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="send near-duplicate reviews to the model separately")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8,
+                        help="estimated word 3-gram similarity above which two reviews are duplicates")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not use the persistent response cache")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--no-store", action="store_true",
+                        help="do not reuse or store the per review results of earlier runs")
+    parser.add_argument("--store-path", default=DEFAULT_STORE_PATH,
+                        help="SQLite file with the per product extraction and comparison results")
+    parser.add_argument("--category-index", default=DEFAULT_INDEX_PATH,
+                        help="JSON file with the attribute categories of each product vertical")
+
+
+def check_pipeline_arguments(parser, args):
+    stage_models = [args.extract_model, args.compare_model, args.group_model]
+    if not args.api_key and any(model_name != REPLAY_BACKEND for model_name in stage_models):
+        parser.error("an API key is required, pass --api-key or set GOOGLE_API_KEY")
+    if REPLAY_BACKEND in stage_models and not args.replay:
+        parser.error("the replay backend needs --replay")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the PRAISE pipeline over a JSONL file of {product_id, description, reviews, vertical} records")
+    parser.add_argument("input", help="JSONL file with one product per line")
+    parser.add_argument("--output", default="praise_results.jsonl",
+                        help="JSONL file the results are appended to")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of products processed in parallel")
+    parser.add_argument("--metrics", help="JSONL file the per product and stage metrics are appended to")
+    parser.add_argument("--prometheus", help="file the run totals are written to in the prometheus text format")
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+    check_pipeline_arguments(parser, args)
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(run_batch(parse_args()))
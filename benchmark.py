@@ -0,0 +1,320 @@
+import argparse
+import ast
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from batch import process_product
+from canonicalize import SynonymTable
+from category_index import CategoryIndex
+from llm_cache import ResponseCache, CachedModel
+from metrics import Metrics
+from ratelimit import RateLimiter, CircuitBreaker, ResilientModel
+
+
+ATTRIBUTES = {
+    "color": ["red", "blue", "black", "white", "green", "grey"],
+    "size": ["small", "medium", "large", "x large"],
+    "material": ["cotton", "polyester", "wool", "linen", "silk"],
+    "fit": ["slim", "regular", "relaxed"],
+    "weight": ["200 grams", "300 grams", "450 grams"],
+    "length": ["short", "regular length", "long"],
+    "collar": ["round neck", "v neck", "crew neck"],
+    "pocket": ["one pocket", "two pockets", "no pockets"],
+    "wash": ["machine wash", "hand wash", "dry clean"],
+    "sleeve": ["short sleeves", "long sleeves", "sleeveless"],
+}
+OPINIONS = ["I love it.", "Great value for the money.", "Would buy again.", "Not what I hoped for.", ""]
+DESCRIPTIVE_PATTERN = re.compile(r"the (\w+) is ([\w ]+?)[.!]", flags=re.IGNORECASE)
+
+
+class MockAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class MockResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+def sample_latency(rng, distribution, median, spread):
+    if distribution == "constant":
+        return median
+    if distribution == "uniform":
+        return rng.uniform(median * (1 - spread), median * (1 + spread))
+    if distribution == "exponential":
+        return rng.expovariate(math.log(2) / median) if median > 0 else 0.0
+    # lognormal, spread is the standard deviation of the log latency
+    return median * math.exp(rng.gauss(0, spread))
+
+
+# stands in for the Gemini generate_content endpoint: it recognizes the extraction, comparison and
+# grouping prompts of the pipeline and answers them from the synthetic reviews, after a sampled
+# latency, failing a configurable share of calls with 429 and 500 errors or a malformed reply
+class MockModel:
+    def __init__(self, distribution="lognormal", median=0.05, spread=0.5, rate_limit_rate=0.0, server_error_rate=0.0,
+                 malformed_rate=0.0, seed=0):
+        self.distribution = distribution
+        self.median = median
+        self.spread = spread
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt_parts, **kwargs):
+        with self._lock:
+            self.calls += 1
+            latency = sample_latency(self._rng, self.distribution, self.median, self.spread)
+            outcome = self._rng.random()
+        time.sleep(max(0.0, latency))
+        if outcome < self.rate_limit_rate:
+            raise MockAPIError(429, "Resource exhausted")
+        outcome -= self.rate_limit_rate
+        if outcome < self.server_error_rate:
+            raise MockAPIError(500, "Internal error")
+        outcome -= self.server_error_rate
+
+        if outcome < self.malformed_rate:
+            text = "I'm sorry, here is the answer: | | |"
+        else:
+            text = self.answer([str(part) for part in prompt_parts])
+        if kwargs.get("stream"):
+            return [MockResponse(line) for line in text.splitlines(keepends=True)]
+        return MockResponse(text)
+
+    def answer(self, parts):
+        if "DICTIONARY" in parts[0]:
+            return self.answer_grouping(parts)
+        if "Output table for Review X" in parts[0]:
+            return self.answer_comparison(parts)
+        return self.answer_extraction(parts)
+
+    def answer_extraction(self, parts):
+        if "numbered from 1" in parts[-2]:
+            reviews = re.findall(r"^Review (\d+): (.*)$", parts[-3], flags=re.MULTILINE)
+            return "\n".join(f"### Review {number}\n{self.extract(review)}" for number, review in reviews)
+        return self.extract(parts[-2].rsplit("Review: ", 1)[1])
+
+    def extract(self, review):
+        pairs = "\n".join(f"{attribute.lower()}: {value.lower()}" for attribute, value in DESCRIPTIVE_PATTERN.findall(review))
+        return f"Opinions to be discarded: none\nExtracted descriptive pairs\n{pairs}"
+
+    def answer_comparison(self, parts):
+        description = parts[1].split("Seller Description: ", 1)[1].split("\n\nAll reviews", 1)[0]
+        described = dict(DESCRIPTIVE_PATTERN.findall(description))
+        tables = []
+        for number, review in enumerate(re.findall(r"^Review: (.*)$", parts[1], flags=re.MULTILINE), start=1):
+            rows = ["Attribute | Value | Description"]
+            for attribute, value in ast.literal_eval(review).items():
+                if attribute not in described:
+                    status = "missing"
+                elif described[attribute] == value:
+                    status = f"matches >> the {attribute} is {value}"
+                elif value in described[attribute] or described[attribute] in value:
+                    status = f"partially matches >> the {attribute} is {described[attribute]}"
+                else:
+                    status = f"contradicts >> the {attribute} is {described[attribute]}"
+                rows.append(f"{attribute} | {value} | {status}")
+            tables.append(f"Output table for Review {number}\n" + "\n".join(rows))
+        return "\n\n".join(tables)
+
+    def answer_grouping(self, parts):
+        listed = [part for part in parts if "List of attributes:" in part][-1]
+        attributes = [line for line in listed.split("List of attributes:\n", 1)[1].split("\n") if line.strip()]
+        dictionary = {}
+        for attribute in attributes:
+            category = "Physical Attributes" if attribute in ("size", "weight", "length", "fit") else "Style Attributes"
+            dictionary.setdefault(category, []).append(attribute)
+        return f"DICTIONARY\n{json.dumps(dictionary)}\nEXPLANATION\nGrouped by what the attributes describe."
+
+
+# records the duration of every call of a stage for the latency percentiles
+class CallTimer:
+    def __init__(self, model, durations):
+        self.model = model
+        self.durations = durations
+
+    def generate_content(self, prompt_parts, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.model.generate_content(prompt_parts, **kwargs)
+        finally:
+            self.durations.append(time.perf_counter() - start)
+
+
+def synthetic_product(size, seed=0, duplicate_fraction=0.2):
+    rng = random.Random(seed)
+    described = {attribute: rng.choice(values) for attribute, values in list(ATTRIBUTES.items())[:6]}
+    description = " ".join(f"The {attribute} is {value}." for attribute, value in described.items())
+
+    reviews = []
+    for i in range(size):
+        if reviews and rng.random() < duplicate_fraction:
+            # syndicated copies and spam differ only in case and punctuation
+            review = rng.choice(reviews)["review"]
+            reviews.append({"review": review.upper() if rng.random() < 0.5 else review.rstrip(".") + "!"})
+            continue
+        attributes = rng.sample(list(ATTRIBUTES), rng.randint(2, 4))
+        sentences = [f"The {attribute} is {rng.choice(ATTRIBUTES[attribute])}." for attribute in attributes]
+        reviews.append({"review": " ".join(sentences + [rng.choice(OPINIONS)]).strip()})
+    return {"product_id": f"synthetic-{size}", "description": description, "reviews": reviews}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def run_size(args, size):
+    product = synthetic_product(size, args.seed, args.duplicate_fraction)
+    mock = MockModel(args.latency_distribution, args.latency_median, args.latency_spread, args.rate_limit_rate,
+                     args.server_error_rate, args.malformed_rate, args.seed)
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    # the circuit breaker pauses for a minute once open, which would only measure the pause
+    breaker = CircuitBreaker(failure_threshold=10 ** 6)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(os.path.join(directory, "responses.sqlite")) if args.cache else None
+        durations = {}
+        models = {}
+        for stage in ["extract", "compare", "group"]:
+            model = ResilientModel(mock, limiter=limiter, breaker=breaker, base_delay=args.retry_delay,
+                                   max_delay=args.retry_delay * 8)
+            if cache is not None:
+                model = CachedModel(model, cache, "mock", {})
+            models[stage] = CallTimer(model, durations.setdefault(stage, []))
+
+        def run_pass(name, metrics):
+            pass_args = argparse.Namespace(**dict(vars(args), checkpoint_dir=os.path.join(directory, name)))
+            process_product(product, models, pass_args, CategoryIndex(os.path.join(directory, name, "index.json")),
+                            SynonymTable(os.path.join(directory, name, "synonyms.json")), metrics)
+
+        if cache is not None:
+            # a first pass fills the response cache, the measured pass then runs against the warm cache
+            run_pass("warmup", Metrics())
+            for stage_durations in durations.values():
+                stage_durations.clear()
+
+        metrics = Metrics()
+        calls_before = mock.calls
+        start = time.perf_counter()
+        run_pass("measured", metrics)
+        elapsed = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    totals = {field: sum(values[field] for values in snapshot.values())
+              for field in ["calls", "retries", "cache_hits", "parse_failures", "prompt_tokens", "output_tokens"]}
+    return {
+        "reviews": size,
+        "seconds": elapsed,
+        "reviews_per_second": size / elapsed if elapsed else 0.0,
+        "api_calls": mock.calls - calls_before,
+        "api_calls_per_review": (mock.calls - calls_before) / size if size else 0.0,
+        **totals,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": {stage: {"seconds": values["seconds"], "calls": values["calls"],
+                           "p50_call_seconds": percentile(durations.get(stage, []), 0.5),
+                           "p99_call_seconds": percentile(durations.get(stage, []), 0.99)}
+                   for stage, values in snapshot.items()},
+    }
+
+
+def run_size_in_process(args, size, results):
+    try:
+        results.put(run_size(args, size))
+    except Exception as e:
+        results.put({"reviews": size, "error": f"{type(e).__name__}: {e}"})
+
+
+# every corpus size runs in its own process so its peak memory is not inflated by the larger ones
+def run_benchmark(args):
+    context = multiprocessing.get_context("spawn")
+    reports = []
+    for size in args.sizes:
+        results = context.Queue()
+        process = context.Process(target=run_size_in_process, args=(args, size, results))
+        process.start()
+        report = results.get()
+        process.join()
+        reports.append(report)
+        print(format_report(report), file=sys.stderr)
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(report, settings=settings(args))) + "\n")
+    return reports
+
+
+def settings(args):
+    return {key: value for key, value in vars(args).items() if key not in ("sizes", "output", "checkpoint_dir")}
+
+
+def format_report(report):
+    if "error" in report:
+        return f"{report['reviews']} reviews: failed with {report['error']}"
+    lines = [f"{report['reviews']} reviews: {report['seconds']:.2f}s, {report['reviews_per_second']:.1f} reviews/s, "
+             f"{report['api_calls']} api calls ({report['api_calls_per_review']:.3f} per review), "
+             f"{report['retries']} retries, {report['cache_hits']} cache hits, {report['parse_failures']} parse failures, "
+             f"peak rss {report['peak_rss_mb']:.0f} MB"]
+    for stage, values in report["stages"].items():
+        lines.append(f"  {stage:<13} {values['seconds']:8.3f}s  {values['calls']:6d} calls  "
+                     f"p50 {values['p50_call_seconds'] * 1000:8.1f} ms  p99 {values['p99_call_seconds'] * 1000:8.1f} ms")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the PRAISE pipeline on synthetic reviews against a local mock of the model API")
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000",
+                        type=lambda text: [int(size) for size in text.split(",")],
+                        help="comma separated numbers of reviews per synthetic product")
+    parser.add_argument("--output", help="JSONL file the reports are appended to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.2,
+                        help="share of reviews that copy an earlier review")
+    parser.add_argument("--latency-distribution", default="lognormal",
+                        choices=["constant", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--latency-median", type=float, default=0.05,
+                        help="median seconds of a mock model call")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="relative half width for uniform, log standard deviation for lognormal")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="share of calls failing with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0,
+                        help="share of calls failing with 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="share of calls answered with unparseable output")
+    parser.add_argument("--retry-delay", type=float, default=0.01,
+                        help="base delay of the retry backoff")
+    parser.add_argument("--requests-per-minute", type=int, default=10 ** 6)
+    parser.add_argument("--tokens-per-minute", type=int, default=10 ** 9)
+    parser.add_argument("--cache", action="store_true",
+                        help="measure a second pass over a warm response cache")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    parser.add_argument("--repair-attempts", type=int, default=2)
+    parser.add_argument("--no-batching", action="store_true")
+    parser.add_argument("--separate-grouping", action="store_true")
+    parser.add_argument("--no-prematch", action="store_true")
+    parser.add_argument("--no-canonicalize", action="store_true")
+    parser.add_argument("--no-dedup", action="store_true")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run_benchmark(parse_args())
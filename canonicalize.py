@@ -0,0 +1,152 @@
+import difflib
+import os
+import re
+import threading
+from collections import Counter
+
+from json_files import read_json, write_json, file_stamp, locked
+
+
+DEFAULT_SYNONYMS_PATH = os.path.join('.praise_cache', 'synonyms.json')
+
+# words that qualify an attribute without changing what it describes, "colour options" is a colour
+MODIFIER_WORDS = {"option", "choice", "variant", "available"}
+
+
+def stem(word):
+    # plural stripping only, anything more aggressive merges attributes that differ in meaning
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    for suffix, replacement in (("ies", "y"), ("sses", "ss"), ("ches", "ch"), ("shes", "sh"), ("xes", "x"), ("s", "")):
+        if word.endswith(suffix):
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def attribute_signature(attribute):
+    words = re.findall(r"[a-z0-9]+", str(attribute).lower())
+    stems = [stem(word) for word in words]
+    meaningful = [word for word in stems if word not in MODIFIER_WORDS]
+    return " ".join(meaningful or stems)
+
+
+# persisted signature -> canonical attribute table, seeded by hand or learned from earlier runs.
+# Other processes using the same file, like the service workers, see each other's entries
+class SynonymTable:
+    def __init__(self, path=DEFAULT_SYNONYMS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = file_stamp(path)
+        self._synonyms = read_json(path)
+
+    def get(self, signature):
+        with self._lock:
+            stamp = file_stamp(self.path)
+            if stamp != self._stamp:
+                self._synonyms = read_json(self.path)
+                self._stamp = stamp
+            return self._synonyms.get(signature)
+
+    # the file is read again under the lock and the new entries are added to it
+    def update(self, synonyms):
+        with self._lock, locked(self.path):
+            self._synonyms = read_json(self.path)
+            self._stamp = file_stamp(self.path)
+            changed = False
+            for signature, canonical in synonyms.items():
+                if self._synonyms.get(signature) != canonical:
+                    self._synonyms[signature] = canonical
+                    changed = True
+            if changed:
+                write_json(self.path, self._synonyms)
+                self._stamp = file_stamp(self.path)
+
+
+# fuzzy matching is only meant for spellings of the same words: both signatures have the same
+# number of words, the same numbers, and each word that differs is a close spelling of the other,
+# so "colour" merges with "color" but "wrist size" stays apart from "waist size"
+def spelling_variants(signature, other, threshold=0.85):
+    words, other_words = signature.split(), other.split()
+    if len(words) != len(other_words):
+        return False
+    for word, other_word in zip(words, other_words):
+        if word == other_word:
+            continue
+        if re.search(r"\d", word + other_word):
+            return False
+        if difflib.SequenceMatcher(None, word, other_word).ratio() < threshold:
+            return False
+    return True
+
+
+# maps every attribute to a canonical one, returns {attribute: (canonical, reason)}
+def build_canonical_mapping(attributes, synonyms=None, threshold=0.85):
+    mapping = {}
+    canonical_by_signature = {}
+    signatures_by_initial = {}
+
+    # the most frequent spelling of a cluster becomes its canonical name
+    for attribute, _ in Counter(attributes).most_common():
+        signature = attribute_signature(attribute)
+
+        canonical = synonyms.get(signature) if synonyms is not None else None
+        if canonical is not None:
+            mapping[attribute] = (canonical, "synonym table")
+            canonical_by_signature.setdefault(signature, canonical)
+            continue
+
+        if signature in canonical_by_signature:
+            mapping[attribute] = (canonical_by_signature[signature], "normalized")
+            continue
+
+        # fuzzy matching only looks at signatures with the same first character to stay fast on large key sets
+        candidates = signatures_by_initial.setdefault(signature[:1], [])
+        close = [candidate for candidate in difflib.get_close_matches(signature, candidates, n=3, cutoff=threshold)
+                 if spelling_variants(signature, candidate)]
+        if close:
+            ratio = difflib.SequenceMatcher(None, signature, close[0]).ratio()
+            canonical = canonical_by_signature[close[0]]
+            mapping[attribute] = (canonical, f"fuzzy match ({ratio:.2f}), this run only")
+            canonical_by_signature[signature] = canonical
+            continue
+
+        mapping[attribute] = (attribute, "canonical")
+        canonical_by_signature[signature] = attribute
+        candidates.append(signature)
+
+    return mapping
+
+
+# rewrites the keys of each review's descriptive details to their canonical attribute. Keys of one
+# review that collapse onto the same attribute keep all their values. Returns the rewritten details
+# and the audit trail of every key that was changed
+def canonicalize_descriptive_details(descriptive_details, synonyms=None, threshold=0.85):
+    attributes = [key for review in descriptive_details for key in review]
+    mapping = build_canonical_mapping(attributes, synonyms, threshold)
+
+    canonical_details = []
+    for review in descriptive_details:
+        canonical_review = {}
+        for key, value in review.items():
+            canonical = mapping[key][0]
+            if canonical in canonical_review and value not in canonical_review[canonical].split(", "):
+                canonical_review[canonical] += f", {value}"
+            else:
+                canonical_review.setdefault(canonical, value)
+        canonical_details.append(canonical_review)
+
+    audit_trail = [{"Attribute": attribute, "Canonical attribute": canonical, "Reason": reason}
+                   for attribute, (canonical, reason) in mapping.items() if attribute != canonical]
+
+    # remember the clusters so later runs resolve them directly. Fuzzy matches are a guess that
+    # would then apply to every later product of every vertical, so they are never saved
+    if synonyms is not None:
+        fuzzy_signatures = {attribute_signature(attribute)
+                            for attribute, (_, reason) in mapping.items() if reason.startswith("fuzzy")}
+        learned = {attribute_signature(attribute): canonical
+                   for attribute, (canonical, _) in mapping.items()
+                   if attribute != canonical and attribute_signature(attribute) not in fuzzy_signatures}
+        synonyms.update({signature: canonical for signature, canonical in learned.items()
+                         if signature != canonical})
+
+    return canonical_details, audit_trail
@@ -0,0 +1,77 @@
+import os
+import threading
+
+from json_files import read_json, write_json, file_stamp, locked
+
+
+DEFAULT_INDEX_PATH = os.path.join('.praise_cache', 'category_index.json')
+
+
+def normalize_attribute(attribute):
+    return str(attribute).strip().lower()
+
+
+# persistent attribute -> categories index per product vertical, so attributes that
+# were grouped before are resolved locally and keep the same category names. Other processes
+# using the same file, like the service workers, see each other's assignments
+class CategoryIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = file_stamp(path)
+        self._verticals = read_json(path)
+
+    # picks up what other processes saved since the file was last read
+    def _refresh(self):
+        stamp = file_stamp(self.path)
+        if stamp != self._stamp:
+            self._verticals = read_json(self.path)
+            self._stamp = stamp
+
+    def categories(self, vertical):
+        with self._lock:
+            self._refresh()
+            attributes = self._verticals.get(vertical, {})
+            return sorted({category for categories in attributes.values() for category in categories})
+
+    # splits attributes into the ones the index already knows and the unseen ones
+    def lookup(self, vertical, attributes):
+        with self._lock:
+            self._refresh()
+            known = self._verticals.get(vertical, {})
+            unseen = []
+            for attribute in attributes:
+                if normalize_attribute(attribute) not in known and attribute not in unseen:
+                    unseen.append(attribute)
+            return unseen
+
+    def group(self, vertical, attributes):
+        with self._lock:
+            self._refresh()
+            known = self._verticals.get(vertical, {})
+            category_dict = {}
+            for attribute in attributes:
+                for category in known.get(normalize_attribute(attribute), []):
+                    if attribute not in category_dict.setdefault(category, []):
+                        category_dict[category].append(attribute)
+            return category_dict
+
+    # the file is read again under the lock and the new assignments are added to it, it is
+    # only written when some assignment was new, the demo calls this on every rerun
+    def update(self, vertical, category_dict):
+        with self._lock, locked(self.path):
+            self._verticals = read_json(self.path)
+            self._stamp = file_stamp(self.path)
+            known = self._verticals.setdefault(vertical, {})
+            changed = False
+            for category, attributes in category_dict.items():
+                if isinstance(attributes, str):
+                    attributes = [attributes]
+                for attribute in attributes:
+                    categories = known.setdefault(normalize_attribute(attribute), [])
+                    if category not in categories:
+                        categories.append(category)
+                        changed = True
+            if changed:
+                write_json(self.path, self._verticals)
+                self._stamp = file_stamp(self.path)
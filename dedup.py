@@ -0,0 +1,89 @@
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def normalize_review(review):
+    return " ".join(re.findall(r"[a-z0-9]+", str(review).lower()))
+
+
+def shingles(text, size=3):
+    words = text.split()
+    if len(words) < size:
+        return {text}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+# the products wrap around in uint64, only the well mixed low 32 bits of each hash are kept
+def minhash_signature(text, a, b, size=3):
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text, size)),
+                         dtype=np.uint64)
+    return (((np.outer(a, hashes) + b[:, None]) % MERSENNE_PRIME) & MAX_HASH).min(axis=1)
+
+
+# clusters reviews one at a time as they arrive: exact duplicates (same text after normalization)
+# and near duplicates (MinHash estimate of the word 3-gram Jaccard similarity at or above threshold,
+# candidates found through LSH banding). Only the first review of each cluster is indexed, so memory
+# grows with the number of clusters and a review is only compared with cluster representatives
+class DuplicateIndex:
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, seed=1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = generator.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.representatives = []
+        # signatures of the representatives, grown by doubling so candidates are compared in one numpy call
+        self.signatures = np.zeros((64, num_perm), dtype=np.uint64)
+        self.by_hash = {}
+        self.buckets = [{} for _ in range(bands)]
+
+    # returns the position of the review's cluster in representatives, adding a new cluster if needed
+    def add(self, index, review):
+        text = normalize_review(review)
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        if digest in self.by_hash:
+            return self.by_hash[digest]
+
+        cluster = None
+        keys = []
+        if self.threshold < 1.0:
+            signature = minhash_signature(text, self.a, self.b)
+            keys = [band.tobytes() for band in signature.reshape(self.bands, self.rows)]
+            candidates = set()
+            for band, key in enumerate(keys):
+                candidates.update(self.buckets[band].get(key, ()))
+            if candidates:
+                # the earliest similar cluster wins so the assignment does not depend on set order
+                candidates = np.array(sorted(candidates))
+                similarity = (self.signatures[candidates] == signature).mean(axis=1)
+                similar = np.flatnonzero(similarity >= self.threshold)
+                if similar.size:
+                    cluster = int(candidates[similar[0]])
+
+        if cluster is None:
+            cluster = len(self.representatives)
+            self.representatives.append(index)
+            if keys:
+                if cluster == len(self.signatures):
+                    self.signatures = np.vstack([self.signatures, np.zeros_like(self.signatures)])
+                self.signatures[cluster] = signature
+                for band, key in enumerate(keys):
+                    self.buckets[band].setdefault(key, []).append(cluster)
+        self.by_hash[digest] = cluster
+        return cluster
+
+
+# returns the indices of one representative per cluster and, for every review, the position of
+# its cluster's representative in that list
+def find_duplicate_reviews(reviews, threshold=0.8, num_perm=64, bands=16, seed=1):
+    index = DuplicateIndex(threshold, num_perm, bands, seed)
+    assignments = [index.add(i, review) for i, review in enumerate(reviews)]
+    return index.representatives, assignments
@@ -1,50 +1,92 @@
 import streamlit as st
 import json
+import re
+import time
+import hashlib
+import queue
+import numpy as np
 import pandas as pd
-import google.generativeai as genai
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from llm_cache import ResponseCache, invalidate_cached_response
+from ratelimit import RateLimiter, CircuitBreaker
+from backends import STAGES, DEFAULT_STAGE_MODELS, REPLAY_BACKEND, BLOCKED_RESPONSE_ERRORS, build_stage_models
+from category_index import CategoryIndex
+from canonicalize import SynonymTable, canonicalize_descriptive_details
+from prematch import prematch_reviews, table_cell
+from metrics import Metrics, InstrumentedModel, estimate_tokens
+from dedup import DuplicateIndex
+from review_reader import iter_reviews, source_digest
+from result_store import ResultStore, review_hash, details_hash, config_key
+from service_client import ServiceError, submit_job, job_status, job_result
 
 
-def gemini_setup(temperature, tokens):
-    if not st.session_state.api_key:
+# one response cache per server process, shared by all sessions and reruns
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+
+@st.cache_resource
+def get_category_index():
+    return CategoryIndex()
+
+
+@st.cache_resource
+def get_synonym_table():
+    return SynonymTable()
+
+
+@st.cache_resource
+def get_result_store():
+    return ResultStore()
+
+
+# the quota is per api key, so every session in the process shares one limiter and breaker
+@st.cache_resource
+def get_rate_limiter(requests_per_minute, tokens_per_minute):
+    return RateLimiter(requests_per_minute, tokens_per_minute), CircuitBreaker()
+
+
+# label shown in the model selectors -> model name understood by build_stage_models
+MODEL_CHOICES = {
+    'Gemini 1.5 Pro': 'gemini-1.5-pro-latest',
+    'Gemini 1.5 Flash': 'gemini-1.5-flash-latest',
+    'Offline replay of recorded responses': REPLAY_BACKEND,
+}
+
+STAGE_LABELS = {
+    'extract': 'Step 1: extraction of descriptive details',
+    'compare': 'Step 2: comparison with the seller description',
+    'group': 'Step 4: grouping of attributes',
+}
+
+
+def stage_models_setup(stage_models, temperature, tokens):
+    uses_api = any(model_name != REPLAY_BACKEND for model_name in stage_models.values())
+    if uses_api and not st.session_state.api_key:
         st.error('Please enter your API key to proceed')
         st.stop()
-    else:
-        genai.configure(api_key=st.session_state.api_key)
-    
-        # Set up the model
-        generation_config = {
-            "temperature": temperature,
-            "max_output_tokens": tokens,
-        }
-
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_NONE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_NONE"
-            },
-        ]
+    limiter, breaker = get_rate_limiter(st.session_state.requests_per_minute,
+                                        st.session_state.tokens_per_minute)
+    try:
+        models = build_stage_models(stage_models, st.session_state.api_key, temperature, tokens,
+                                    limiter=limiter, breaker=breaker, cache=get_response_cache(),
+                                    replay_path=st.session_state.get('replay_path'),
+                                    replay_latency=st.session_state.get('replay_latency', 0.0))
+    except Exception as e:
+        st.error(f"Error setting up the model: {e}")
+        st.stop()
+
+    return models
 
-        try:
-            model = genai.GenerativeModel(model_name="gemini-1.5-pro-latest",
-                                    generation_config=generation_config,
-                                    safety_settings=safety_settings)
-        except Exception as e:
-            st.error(f"Error setting up the model: {e}")
-            st.stop()
 
-        return model
+# the model configured for a stage by the Configure model button
+def get_stage_model(stage):
+    models = st.session_state.get('models') or {}
+    if models.get(stage) is None:
+        raise RuntimeError(f"No model is configured for the {stage} stage, press 'Configure model' first")
+    return models[stage]
 
 
 def hyperparameters():
@@ -53,16 +95,68 @@ def hyperparameters():
         'Select the temperature for the model', 0.0, 2.0, 1.0)
     st.session_state.max_tokens = st.slider(
         'Select the maximum tokens for the model', 1, 8000, 4000)
+    st.session_state.concurrency = st.slider(
+        'Select the number of concurrent model calls', 1, 32, 8)
+    st.session_state.requests_per_minute = st.number_input(
+        'Enter the request quota per minute for your API key', 1, 10000, 60)
+    st.session_state.tokens_per_minute = st.number_input(
+        'Enter the token quota per minute for your API key', 1000, 100000000, 1000000)
+    st.session_state.repair_attempts = st.slider(
+        'Select the number of repair attempts for malformed comparison tables', 0, 5, 2)
+    st.session_state.stream_results = st.checkbox(
+        'Show results as they are generated', value=True)
+    st.session_state.combined_grouping = st.checkbox(
+        'Group the attributes of all tables in one request', value=True)
+    st.session_state.canonicalize_attributes = st.checkbox(
+        'Merge synonymous attributes before the comparison', value=True)
+    st.session_state.prematch = st.checkbox(
+        'Match trivially matching or missing attributes without the model', value=True)
+    st.session_state.batch_extraction = st.checkbox(
+        'Pack several reviews into each extraction request', value=True)
+    st.session_state.deduplicate = st.checkbox(
+        'Send only one review of each group of near-duplicate reviews to the model', value=True)
+    st.session_state.dedup_threshold = st.slider(
+        'Select the similarity above which reviews count as duplicates', 0.5, 1.0, 0.8)
+
+
+# cache=False asks for a fresh reply instead of the cached one, for repairs of a rejected reply
+def generate_response(model, prompt_parts, cache=True):
+    # throttling and retries of transient errors happen in the ResilientModel set up by build_stage_models
+    if not cache:
+        return model.generate_content(prompt_parts, cache=False)
+    return model.generate_content(prompt_parts)
+
+
+def stream_response(model, prompt_parts, cache=True):
+    options = {} if cache else {"cache": False}
+    for chunk in model.generate_content(prompt_parts, stream=True, **options):
+        yield chunk.text
 
 # -----------------------------------------------------------------------------------------------------------
 
 # Step 1: Extract attributes from reviews and add keys to attributes
 
 
-def extract_descriptive_details_from_reviews(reviews):
-    model = st.session_state.model
+def parse_descriptive_pairs(text):
+    pairs = text.strip().split('\n')
 
-    descriptive_details_list = []
+    review_dict = {}
+    for pair in pairs:
+        if ': ' in pair:
+            key, value = pair.split(': ', 1)
+            if "opinion" not in key.lower() and "extracted" not in key.lower():
+                review_dict[key.strip()] = value.strip()
+    return review_dict
+
+
+# bumped whenever the extraction prompt changes, so stored extractions of the old prompt are not reused
+EXTRACTION_PROMPT_VERSION = 1
+
+
+def extract_descriptive_details_from_reviews(reviews, model=None, concurrency=1, progress=None, batched=False, max_output_tokens=None, on_result=None,
+                                             on_parse_failure=None):
+    if model is None:
+        model = get_stage_model('extract')
 
     system_prompt = "Your aim for this task is to discard opinions and retain only descriptive information. For each review that you are provided you have to output the \"Opinions to be discarded\" and \"Extracted descriptive pairs\" which should be in the form of a list with key:value pairs."
 
@@ -78,39 +172,138 @@ def extract_descriptive_details_from_reviews(reviews):
         prompt_parts.append(main_prompt.format(review=review))
         prompt_parts.append(f"output: {output}")
 
-    for review in reviews:
+    batch_prompt = "The input above contains {count} reviews numbered from 1 to {count}. Apply the same instructions to each review separately and do not merge or skip any review. Start the output for each review with a line of the form \"### Review X\" where X is the review number, followed by its \"Opinions to be discarded\" and \"Extracted descriptive pairs\" in the same format as before."
+
+    def extract_one(review, cache=True):
         model_final_prompt = prompt_parts.copy()
         model_final_prompt.append(main_prompt.format(review=review))
         model_final_prompt.append("output:")
 
-        # generate a response and keep trying if you get internal server error
-        response = None
-        while response is None:
-            try:
-                response = model.generate_content(model_final_prompt)
-            except Exception as e:
-                if "internal error" in str(e).lower():
-                    continue
-                else:
-                    raise e
-
+        response = generate_response(model, model_final_prompt, cache=cache)
         try:
-            pairs = response.text.strip().split('\n')
-        except:
-            return "Safety Error!"
+            return parse_descriptive_pairs(response.text)
+        except BLOCKED_RESPONSE_ERRORS:
+            if on_parse_failure is not None:
+                on_parse_failure(1)
+            return None
+
+    # several reviews share one copy of the few-shot prefix, the reply is split
+    # back on the review headers and any review that can't be found in it is
+    # extracted again on its own
+    def extract_batch(batch):
+        if len(batch) == 1:
+            return {batch[0][0]: extract_one(batch[0][1])}
+
+        numbered_reviews = "\n".join(
+            f"Review {k}: {review}" for k, (_, review) in enumerate(batch, start=1))
+        model_final_prompt = prompt_parts.copy()
+        model_final_prompt.append(main_prompt.replace(
+            "Review: {review}", "Reviews:\n{review}").format(review=numbered_reviews))
+        model_final_prompt.append(batch_prompt.format(count=len(batch)))
+        model_final_prompt.append("output:")
 
-        review_dict = {}
-        for pair in pairs:
-            if ': ' in pair:
-                key, value = pair.split(': ', 1)
-                if "opinion" not in key.lower() and "extracted" not in key.lower():
-                    review_dict[key.strip()] = value.strip()
+        response = generate_response(model, model_final_prompt)
+        try:
+            sections = split_batched_extraction(response.text, len(batch))
+        except BLOCKED_RESPONSE_ERRORS:
+            sections = {}
+
+        # a reply with missing reviews is not kept in the cache, a rerun would get it back
+        if len(sections) < len(batch):
+            invalidate_cached_response(model, model_final_prompt)
+            if on_parse_failure is not None:
+                on_parse_failure(len(batch) - len(sections))
+        results = {}
+        for k, (i, review) in enumerate(batch, start=1):
+            if k in sections:
+                results[i] = parse_descriptive_pairs(sections[k])
+            else:
+                results[i] = extract_one(review, cache=False)
+        return results
 
-        descriptive_details_list.append(review_dict)
+    if batched:
+        if max_output_tokens is None:
+            max_output_tokens = st.session_state.max_tokens
+        batches = iter_extraction_batches(reviews, max_output_tokens)
+    else:
+        batches = ([(i, review)] for i, review in enumerate(reviews))
+
+    # reviews may come from a generator, so the total is only known up front for lists
+    total = len(reviews) if isinstance(reviews, list) else None
+    results = {}
+    submitted = 0
+
+    def collect(future):
+        for i, details in future.result().items():
+            results[i] = details
+            if on_result is not None and details is not None:
+                on_result(i, details)
+            if progress is not None:
+                progress(len(results), total or submitted)
+
+    # the calls are independent, so run them on a bounded thread pool and put the results
+    # back in input order as they complete. Batches are submitted as soon as they are formed
+    # and only a couple per worker wait in the pool, so the input is consumed lazily
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        in_flight = set()
+        for batch in batches:
+            if len(in_flight) >= 2 * max(1, concurrency):
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            submitted += len(batch)
+            in_flight.add(executor.submit(extract_batch, batch))
+        for future in as_completed(in_flight):
+            collect(future)
+
+    descriptive_details_list = [results[i] for i in range(submitted)]
+    if any(details is None for details in descriptive_details_list):
+        return "Safety Error!"
 
     return descriptive_details_list
 
 
+def estimate_extraction_output_tokens(review):
+    # the reply repeats the opinions and lists the pairs, so it grows with the review
+    return 30 + estimate_tokens(review)
+
+
+# greedily pack consecutive reviews into batches whose expected reply fits in the output budget,
+# each batch is yielded as soon as it is full so a review generator is consumed lazily
+def iter_extraction_batches(reviews, max_output_tokens, max_batch_size=25, budget_fraction=0.75):
+    budget = max(1, int(max_output_tokens * budget_fraction))
+    current = []
+    used = 0
+    for i, review in enumerate(reviews):
+        cost = estimate_extraction_output_tokens(review)
+        if current and (used + cost > budget or len(current) >= max_batch_size):
+            yield current
+            current = []
+            used = 0
+        current.append((i, review))
+        used += cost
+    if current:
+        yield current
+
+
+def plan_extraction_batches(reviews, max_output_tokens, max_batch_size=25, budget_fraction=0.75):
+    return list(iter_extraction_batches(reviews, max_output_tokens, max_batch_size, budget_fraction))
+
+
+def split_batched_extraction(text, count):
+    parts = re.split(r"^[#*\s]*Review\s+(\d+)\s*[:*#]*\s*$", text, flags=re.MULTILINE)
+    sections = {}
+    duplicated = set()
+    for number, section in zip(parts[1::2], parts[2::2]):
+        number = int(number)
+        if number in sections:
+            duplicated.add(number)
+        sections[number] = section
+    # a review that shows up twice can't be attributed reliably, so it is dropped
+    return {number: section for number, section in sections.items()
+            if 1 <= number <= count and number not in duplicated}
+
+
 def clean_descriptive_details(descriptive_details):
     cleaned_descriptive_details = []
     for review in descriptive_details:
@@ -126,8 +319,16 @@ def clean_descriptive_details(descriptive_details):
 # Step 2: Comparison with seller's description
 
 
-def compare_with_seller_description(seller_description, reviews):
-    model = st.session_state.model
+# bumped whenever the comparison prompt changes, so stored comparisons of the old prompt are not reused
+COMPARISON_PROMPT_VERSION = 1
+
+
+def compare_with_seller_description(seller_description, reviews, model=None, concurrency=1, max_output_tokens=None, on_row=None,
+                                    cache=True):
+    if model is None:
+        model = get_stage_model('compare')
+    if max_output_tokens is None:
+        max_output_tokens = st.session_state.max_tokens
 
     system_prompt = "For each review, the first line should be \"Output table for Review X\" where X is the review number. Following that,  return one table for each review with three columns - \"Attribute\", \"Value\", \"Description\". Each column should be separated by the | character. Do not use this character anywhere else.\nThe first column should have the attribute from the review, the second column should have the value, and the third column should mention whether the attribute-value pair is \"missing\" from the seller's description, \"matches\", \"partially matches\", or \"contradicts\" the seller's description, or \"expresses opinions\". If the attribute-value pair matches, partially matches, or contradicts the seller's description, provide supporting evidence from the seller's description in the \"Description\" column. The format is 'description >> evidence'. Strictly follow this format and ensure that you provide a valid evidence. The result should mandatorily be in the correct format."
 
@@ -135,33 +336,144 @@ def compare_with_seller_description(seller_description, reviews):
 
     main_prompt = main_prompt.format(seller_desc=seller_description)
 
-    for review in reviews:
-        main_prompt += f"Review: {review}\n"
+    # rows parsed from streamed shards are handed to on_row from the calling
+    # thread, streamlit elements can't be updated from the worker threads
+    rows = queue.Queue()
 
-    prompt_parts = [system_prompt]
-    prompt_parts.append(main_prompt)
-    prompt_parts.append("output:")
+    def compare_shard(shard, offset):
+        shard_prompt = main_prompt
+        for review in shard:
+            shard_prompt += f"Review: {review}\n"
 
-    # generate a response and keep trying if you get internal server error
-    response = None
-    while response is None:
-        try:
-            response = model.generate_content(prompt_parts)
-        except Exception as e:
-            if "internal error" in str(e).lower():
-                continue
-            else:
-                raise e
+        prompt_parts = [system_prompt]
+        prompt_parts.append(shard_prompt)
+        prompt_parts.append("output:")
 
-    try:
-        return response.text.strip()
-    except:
+        if on_row is None:
+            response = generate_response(model, prompt_parts, cache=cache)
+
+            try:
+                shard_output = response.text.strip()
+            except BLOCKED_RESPONSE_ERRORS:
+                return "Safety Error!"
+        else:
+            parser = ReviewTableStreamParser(offset)
+            chunks = []
+            try:
+                for text in stream_response(model, prompt_parts, cache=cache):
+                    chunks.append(text)
+                    for row in parser.feed(text):
+                        rows.put(row)
+            except BLOCKED_RESPONSE_ERRORS:
+                return "Safety Error!"
+            for row in parser.close():
+                rows.put(row)
+            shard_output = "".join(chunks).strip()
+
+        # a reply with malformed tables is not kept in the cache, a rerun would get it back
+        if find_malformed_reviews(shard_output, len(shard)):
+            invalidate_cached_response(model, prompt_parts)
+        return shard_output
+
+    # a single response can't hold the tables for a large number of reviews, so
+    # the reviews are split into shards that each fit in the output budget, the
+    # shards are compared concurrently and their tables are renumbered globally
+    reviews = list(reviews)
+    shards = plan_comparison_shards(reviews, max_output_tokens)
+    offsets = [0]
+    for shard in shards[:-1]:
+        offsets.append(offsets[-1] + len(shard))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(compare_shard, shard, offset)
+                   for shard, offset in zip(shards, offsets)]
+        if on_row is not None:
+            while not all(future.done() for future in futures) or not rows.empty():
+                try:
+                    review_number, row = rows.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                on_row(review_number, row)
+        shard_outputs = [future.result() for future in futures]
+
+    if "Safety Error!" in shard_outputs:
         return "Safety Error!"
 
+    stitched_tables = []
+    for offset, shard_output in zip(offsets, shard_outputs):
+        stitched_tables.append(renumber_review_tables(shard_output, offset))
+    return "\n\n".join(stitched_tables)
+
+
+# turns a streamed "Attribute | Value | Description" response into rows as soon as each line is complete
+class ReviewTableStreamParser:
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.buffer = ""
+        self.review_number = None
+
+    def feed(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        return self._parse(lines)
+
+    def close(self):
+        lines = [self.buffer]
+        self.buffer = ""
+        return self._parse(lines)
+
+    def _parse(self, lines):
+        rows = []
+        for line in lines:
+            match = re.search(r"Output table for Review\s*(\d+)", line)
+            if match:
+                self.review_number = int(match.group(1)) + self.offset
+                continue
+            if self.review_number is None or not line.strip() or "Attribute" in line or "--" in line:
+                continue
+            row_data = [data.strip() for data in line.split("|")]
+            if len(row_data) == 3:
+                rows.append((self.review_number, row_data))
+        return rows
+
+
+def estimate_comparison_output_tokens(review):
+    # one header per table and one row per attribute-value pair with its evidence
+    pairs = review.items() if isinstance(review, dict) else [(review, "")]
+    return 10 + sum(estimate_tokens(key) + estimate_tokens(value) + 20 for key, value in pairs)
+
+
+def plan_comparison_shards(reviews, max_output_tokens, budget_fraction=0.75):
+    budget = max(1, int(max_output_tokens * budget_fraction))
+    shards = []
+    current = []
+    used = 0
+    for review in reviews:
+        cost = estimate_comparison_output_tokens(review)
+        if current and used + cost > budget:
+            shards.append(current)
+            current = []
+            used = 0
+        current.append(review)
+        used += cost
+    if current or not shards:
+        shards.append(current)
+    return shards
+
+
+def renumber_review_tables(review_tables, offset):
+    if offset == 0:
+        return review_tables
+    return re.sub(r"(Output table for Review\s*)(\d+)",
+                  lambda match: f"{match.group(1)}{int(match.group(2)) + offset}", review_tables)
+
 # answering that the output given by the llm is in the correct format, if not, having to run the llm again - can't think of a better way to debug this really
 
 
-def check_compare(review_tables):
+def check_compare(review_tables, review_count=None):
+    if review_count is not None:
+        return not find_malformed_reviews(review_tables, review_count)
+
     tables = review_tables.split("\n\n")
     for table in tables:
         rows = table.split("\n")
@@ -174,38 +486,225 @@ def check_compare(review_tables):
     return True
 
 
-def run_compare(seller_description, reviews):
-    compare_result = False
-    run_num = 0
-    review_tables = ""
+def split_review_tables(review_tables):
+    parts = re.split(r"^.*Output table for Review\s*(\d+).*$",
+                     review_tables, flags=re.MULTILINE)
+    tables = {}
+    for number, table in zip(parts[1::2], parts[2::2]):
+        rows = [row for row in table.split("\n") if row.strip()]
+        tables[int(number)] = "\n".join(rows)
+    return tables
+
+
+# the tables are parsed by position downstream, so with review_count every review up to it gets
+# a table, an empty one when the model never returned it, and the later reviews keep their numbers
+def join_review_tables(tables, review_count=None):
+    numbers = sorted(tables) if review_count is None else range(1, review_count + 1)
+    return "\n\n".join(f"Output table for Review {number}\n{tables.get(number, '')}".strip()
+                        for number in numbers)
+
+
+UNVERIFIED_DESCRIPTION = "unverified >> the model returned no comparison for this review"
+
+
+# compares each distinct set of details once, reusing the tables in stored (details hash -> table),
+# and copies the table to every review with those details, so the review numbers and counts
+# downstream are the same as if every review had been compared. Returns the tables of all the
+# reviews and the well-formed new tables, keyed on their details hash
+def compare_distinct_details(seller_description, reviews, stored=None, on_row=None, **compare_kwargs):
+    reviews = list(reviews)
+    keys = [details_hash(review) for review in reviews]
+    stored = dict(stored or {})
+    first_review = {}
+    for i, key in enumerate(keys):
+        if key not in stored and key not in first_review:
+            first_review[key] = i
+    pending = list(first_review)
+
+    computed = {}
+    if pending:
+        def show_row(number, row):
+            on_row(first_review[pending[number - 1]] + 1, row)
+
+        review_tables = run_compare(seller_description, [reviews[first_review[key]] for key in pending],
+                                    on_row=show_row if on_row is not None else None, **compare_kwargs)
+        if review_tables == "Safety Error!":
+            return review_tables, {}
+        tables = split_review_tables(review_tables)
+        # unverified pairs are compared again on the next run instead of being stored
+        computed = {key: tables[number] for number, key in enumerate(pending, start=1)
+                    if number in tables and not is_malformed_table(tables[number])
+                    and UNVERIFIED_DESCRIPTION not in tables[number]}
+        for number, key in enumerate(pending, start=1):
+            stored[key] = tables.get(number, "")
+
+    return join_review_tables({i + 1: stored[key] for i, key in enumerate(keys)}, len(keys)), computed
+
+
+def is_malformed_table(table):
+    for row in table.split("\n"):
+        if not row.strip() or "Attribute" in row or "--" in row:
+            continue
+        if len(row.split("|")) != 3:
+            return True
+    return False
+
+
+# review numbers (1-based) whose table is absent from the output or has a row without three columns
+def find_malformed_reviews(review_tables, review_count):
+    tables = split_review_tables(review_tables)
+    return [number for number in range(1, review_count + 1)
+            if number not in tables or is_malformed_table(tables[number])]
+
+
+def run_compare(seller_description, reviews, model=None, concurrency=1, max_output_tokens=None, repair_attempts=2, on_row=None,
+                prematch=False, on_parse_failure=None):
+    reviews = list(reviews)
+    if prematch:
+        return run_compare_with_prematch(seller_description, reviews, model=model, concurrency=concurrency,
+                                         max_output_tokens=max_output_tokens, repair_attempts=repair_attempts,
+                                         on_row=on_row, on_parse_failure=on_parse_failure)
+
+    review_tables = compare_with_seller_description(
+        seller_description, reviews, model=model, concurrency=concurrency, max_output_tokens=max_output_tokens,
+        on_row=on_row)
+    if review_tables == "Safety Error!":
+        return review_tables
+
+    # only the reviews whose tables are missing or malformed are compared again,
+    # and their new tables are spliced back in under their original numbers
+    tables = split_review_tables(review_tables)
+    for _ in range(repair_attempts):
+        malformed = find_malformed_reviews(join_review_tables(tables), len(reviews))
+        if not malformed:
+            break
+        if on_parse_failure is not None:
+            on_parse_failure(len(malformed))
+        # the repair asks for a fresh reply, when the malformed reviews make up a whole shard
+        # the prompt is the same and the cache would return the malformed reply again
+        repaired_tables = compare_with_seller_description(
+            seller_description, [reviews[number - 1] for number in malformed], model=model,
+            concurrency=concurrency, max_output_tokens=max_output_tokens, cache=False)
+        if repaired_tables == "Safety Error!":
+            break
+        for local_number, table in split_review_tables(repaired_tables).items():
+            if 1 <= local_number <= len(malformed) and not is_malformed_table(table):
+                tables[malformed[local_number - 1]] = table
+
+    if not tables:
+        return review_tables
+    return join_review_tables(tables, len(reviews))
+
+
+# pairs whose value appears verbatim in the description, or whose attribute and value are
+# nowhere in it, are decided locally and only the remaining pairs go to the model. The
+# local rows are added to each review's table so the output format is unchanged
+def run_compare_with_prematch(seller_description, reviews, model=None, concurrency=1, max_output_tokens=None,
+                              repair_attempts=2, on_row=None, on_parse_failure=None):
+    ambiguous_reviews, prematched_rows = prematch_reviews(seller_description, reviews)
+    if on_row is not None:
+        for i, rows in enumerate(prematched_rows):
+            for row in rows:
+                on_row(i + 1, row)
+
+    compared = [i for i, review in enumerate(ambiguous_reviews) if review]
+    llm_tables = {}
+    if compared:
+        review_tables = run_compare(
+            seller_description, [ambiguous_reviews[i] for i in compared], model=model, concurrency=concurrency,
+            max_output_tokens=max_output_tokens, repair_attempts=repair_attempts,
+            on_row=None if on_row is None else lambda number, row: on_row(compared[number - 1] + 1, row),
+            on_parse_failure=on_parse_failure)
+        if review_tables == "Safety Error!":
+            return review_tables
+        llm_tables = {compared[number - 1] + 1: table
+                      for number, table in split_review_tables(review_tables).items()
+                      if 1 <= number <= len(compared)}
+
+    tables = {}
+    for i, rows in enumerate(prematched_rows):
+        table = llm_tables.get(i + 1, "")
+        # pairs the model never answered for are kept as unverified instead of silently dropped
+        if i + 1 not in llm_tables and ambiguous_reviews[i]:
+            rows = rows + [[table_cell(attribute), table_cell(value), UNVERIFIED_DESCRIPTION]
+                           for attribute, value in ambiguous_reviews[i].items()]
+        if "Attribute" not in table:
+            table = "\n".join(["Attribute | Value | Description", table]).strip()
+        tables[i + 1] = "\n".join([table] + [" | ".join(row) for row in rows])
+    return join_review_tables(tables, len(reviews))
+
+
+ParsedReviewTables = namedtuple(
+    "ParsedReviewTables", ["rows", "error_log", "table_count"])
+
+REVIEW_TABLE_COLUMNS = ["Attribute", "Value", "Description"]
+
+
+REVIEW_TABLE_ROW_PATTERN = r"^\s*([^|]*?)\s*\|\s*([^|]*?)\s*\|\s*([^|]*?)\s*$"
+
+
+def classify_description(description):
+    if "match" in description and "partially match" not in description:
+        return "matches"
+    elif "partially match" in description:
+        return "partially matches"
+    elif "contradict" in description:
+        return "contradicts"
+    elif "opinion" in description:
+        return "opinion"
+    elif "missing" in description:
+        return "missing"
+    else:
+        return "unknown"
 
-    while not compare_result and run_num < 1:
-        review_tables = compare_with_seller_description(seller_description, reviews)
-        compare_result = check_compare(review_tables)
-        run_num += 1
-    return review_tables
 
+def extract_reason(description):
+    if ">>" in description:
+        return description.split(">>")[1].strip()
+    return "no reason available"
 
-def pretty_print_review_tables(review_tables):
+
+# parses the comparison output once into a single frame with one row per
+# attribute, the table it came from, its status and the reason behind it
+def parse_review_tables(review_tables):
     tables = review_tables.split("\n\n")
-    pretty_tables = []
-    for table in tables:
-        pretty_table = []
-        rows = table.split("\n")
-        for row in rows:
-            try:
-                if "Output table" in row or "Attribute" in row or "---" in row:
-                    continue
-                row_data = row.split("|")
-                row_data = [data.strip() for data in row_data]
-            except:
-                continue
+    rows = pd.Series(tables, dtype=object).str.split("\n").explode()
+    rows = rows.rename_axis("Table").reset_index(name="Row")
+    rows = rows[~rows["Row"].str.contains(r"Output table|Attribute|---|^\s*$", regex=True)]
 
-            if len(row_data) == 3:
-                pretty_table.append(row_data)
-        pretty_tables.append(pd.DataFrame(pretty_table, columns=[
-                             "Attribute", "Value", "Description"]))
-    return pretty_tables
+    cells = rows["Row"].str.extract(REVIEW_TABLE_ROW_PATTERN)
+    well_formed = cells[0].notna().to_numpy()
+    error_log = [f"Error in row {[data.strip() for data in row.split('|')]}: Incorrect number of columns"
+                 for row in rows["Row"][~well_formed]]
+
+    cells = cells[well_formed]
+    cells.columns = REVIEW_TABLE_COLUMNS
+    parsed = cells.assign(Table=rows["Table"][well_formed]).reset_index(drop=True)
+    parsed = parsed[["Table"] + REVIEW_TABLE_COLUMNS]
+
+    # the model reuses a handful of descriptions, so each distinct one is classified only once
+    codes, descriptions = pd.factorize(parsed["Description"])
+    statuses = np.array([classify_description(d) for d in descriptions] + ["unknown"], dtype=object)
+    reasons = np.array([extract_reason(d) for d in descriptions] + ["no reason available"], dtype=object)
+    parsed["Status"] = statuses[codes]
+    parsed["Reason"] = reasons[codes]
+
+    return ParsedReviewTables(parsed, error_log, len(tables))
+
+
+def as_parsed_review_tables(review_tables):
+    if isinstance(review_tables, ParsedReviewTables):
+        return review_tables
+    return parse_review_tables(review_tables)
+
+
+def pretty_print_review_tables(review_tables):
+    parsed = as_parsed_review_tables(review_tables)
+    # the rows are in table order, so each table is a contiguous slice of the parsed values
+    values = parsed.rows[REVIEW_TABLE_COLUMNS].to_numpy()
+    bounds = np.searchsorted(parsed.rows["Table"].to_numpy(), np.arange(parsed.table_count + 1))
+    return [pd.DataFrame(values[start:end], columns=REVIEW_TABLE_COLUMNS)
+            for start, end in zip(bounds[:-1], bounds[1:])]
 
 # hihglighting the missing, contradictory, partially matching and opinion based information and change font color to black
 
@@ -223,85 +722,31 @@ def highlight(val):
 # Step 3: Merge Tables (rule based method)
 
 
-def merge_tables(review_tables):
-    tables = review_tables.split("\n\n")
-    all_merged_data = []
-    error_log = []
-    for i, table in enumerate(tables):
-        rows = table.split("\n")
-        for row in rows:
-            try:
-                if "Output table" in row or "Attribute" in row or "---" in row:
-                    continue
-                row = row.strip()
-                if row == "":
-                    continue
-                row_data = row.split("|")
-                row_data = [data.strip() for data in row_data]
-                row_data.append(str(i))
-
-                if ">>" in row_data[2]:
-                    reason = row_data[2].split(">>")[1].strip()
-                else:
-                    reason = "no reason available"
-                row_data.append(reason)
-
-                if "match" in row_data[2] and "partially match" not in row_data[2]:
-                    row_data[2] = "matches"
-                elif "partially match" in row_data[2]:
-                    row_data[2] = "partially matches"
-                elif "contradict" in row_data[2]:
-                    row_data[2] = "contradicts"
-                elif "opinion" in row_data[2]:
-                    row_data[2] = "opinion"
-                elif "missing" in row_data[2]:
-                    row_data[2] = "missing"
-                else:
-                    row_data[2] = "unknown"
-            except Exception as e:
-                error_log.append(f"Error in row {row_data}: {str(e)}")
-                continue
+MERGED_TABLE_STATUSES = ["missing", "contradicts", "partially matches"]
 
-            if len(row_data) == 5:
-                all_merged_data.append(row_data)
-            else:
-                error_log.append(
-                    f"Error in row {row_data}: Incorrect number of columns")
-                continue
 
-    merged_table = pd.DataFrame(all_merged_data, columns=[
-                                "Attribute", "Value", "Description", "Review number", "Reason"])
-    missing_info = merged_table[merged_table["Description"]
-                                == "missing"].sort_values(by="Attribute")
-    contradictory_info = merged_table[merged_table["Description"]
-                                      == "contradicts"].sort_values(by="Attribute")
-    partially_matching_info = merged_table[merged_table["Description"]
-                                           == "partially matches"].sort_values(by="Attribute")
-
-    missing_info = missing_info.drop(columns=["Description", "Reason"])
-    contradictory_info = contradictory_info.drop(columns=['Description'])
-    partially_matching_info = partially_matching_info.drop(columns=[
-                                                           'Description'])
-
-    missing_info = missing_info.dropna()
-    contradictory_info = contradictory_info.dropna()
-    partially_matching_info = partially_matching_info.dropna()
-
-    missing_info = missing_info.groupby('Attribute').agg(
-        {'Value': ', '.join, 'Review number': ', '.join}).reset_index()
-    contradictory_info = contradictory_info.groupby('Attribute').agg(
-        {'Value': ', '.join, 'Review number': ', '.join}).reset_index()
-    partially_matching_info = partially_matching_info.groupby('Attribute').agg(
+def merge_tables(review_tables):
+    parsed = as_parsed_review_tables(review_tables)
+    merged_table = parsed.rows[parsed.rows["Status"].isin(MERGED_TABLE_STATUSES)]
+    merged_table = merged_table.assign(**{"Review number": merged_table["Table"].astype(str)})
+
+    # a single groupby over status and attribute builds all three merged tables
+    merged_table = merged_table.groupby(["Status", "Attribute"], sort=True).agg(
         {'Value': ', '.join, 'Review number': ', '.join}).reset_index()
 
-    return missing_info, contradictory_info, partially_matching_info, error_log
+    missing_info, contradictory_info, partially_matching_info = [
+        merged_table[merged_table["Status"] == status].drop(columns=["Status"]).reset_index(drop=True)
+        for status in MERGED_TABLE_STATUSES]
+
+    return missing_info, contradictory_info, partially_matching_info, list(parsed.error_log)
 # -----------------------------------------------------------------------------------------------------------S
 
 # Step 4: Grouping attributes
 
 
-def group_attributes(table):
-    model = st.session_state.model
+def group_attributes(table, model=None, vertical=None, category_index=None):
+    if model is None:
+        model = get_stage_model('group')
 
     system_prompt = "For this task, your output should be in the form of a dictionary which can be converted to a JSON consisting of key and value pairs. The dictionary should be under the heading \"DICTIONARY\". Additionally, at the end you should also provide a explanation behind your reasoning under the heading of \"EXPLANATION\". The result should mandatorily be in the correct format."
 
@@ -311,14 +756,25 @@ def group_attributes(table):
                           "dimensions", "height", "color", "material"]
     example_output = "DICTIONARY\n{\"Physical Attributes\" : [\"weight\", \"size\", \"dimensions\", \"height\"], \"Material Attributes\" : [\"color\", \"material\"]\nEXPLANATION\nI grouped the attributes into 'Physical Attributes' because they all describe the physical characteristics of the product. Similarly, I grouped 'color' and 'material' into 'Material Attributes' because they both describe the material of the product"
 
+    existing_categories_prompt = "These categories already exist for this kind of product:\n{categories}\nAssign each attribute in the list to one of the existing categories when it fits, using the category name exactly as written above, and only create a new category when none of them fits. The dictionary should contain only the attributes from the list."
+
     prompt_parts = [system_prompt]
     prompt_parts.append(main_prompt.format(
         attributes="\n".join(example_attributes)))
     prompt_parts.append(f"output: {example_output}")
 
+    attribute_list = list(table['Attribute'])
+
+    # attributes that the category index already knows for this vertical are resolved
+    # locally by extract_grouped_attributes, only the unseen ones are sent to the model
+    existing_categories = []
+    if category_index is not None and vertical:
+        existing_categories = category_index.categories(vertical)
+        attribute_list = category_index.lookup(vertical, attribute_list)
+
     attributes = ""
-    for index, row in table.iterrows():
-        attributes += row['Attribute'] + '\n'
+    for attribute in attribute_list:
+        attributes += attribute + '\n'
 
     # check if the list if empty - this is to minimize computation as well as hallucination from the model
     if not attributes:
@@ -326,83 +782,611 @@ def group_attributes(table):
 
     model_final_prompt = prompt_parts.copy()
     model_final_prompt.append(main_prompt.format(attributes=attributes))
+    if existing_categories:
+        model_final_prompt.append(existing_categories_prompt.format(
+            categories="\n".join(existing_categories)))
     model_final_prompt.append("output:")
 
-    # generate a response and keep trying if you get internal server error
-    response = None
-    while response is None:
-        try:
-            response = model.generate_content(model_final_prompt)
-        except Exception as e:
-            if "internal error" in str(e).lower():
-                continue
-            else:
-                raise e
+    response = generate_response(model, model_final_prompt)
 
     try:
-        return response.text.strip()
-    except:
+        text = response.text.strip()
+    except BLOCKED_RESPONSE_ERRORS:
         return "Safety Error!"
+    # a reply without a readable dictionary is not kept in the cache, a rerun would get it back
+    try:
+        parse_grouping_response(text)
+    except (IndexError, ValueError):
+        invalidate_cached_response(model, model_final_prompt)
+    return text
+
+
+def combined_attribute_list(tables):
+    attributes = []
+    seen = set()
+    for table in tables:
+        for attribute in table['Attribute']:
+            if attribute not in seen:
+                seen.add(attribute)
+                attributes.append(attribute)
+    return attributes
+
+
+# groups the deduplicated union of the attributes of several tables in one request, when
+# the dictionary for the union wouldn't fit in the output budget the union is split into
+# chunks that are grouped concurrently. Returns the list of responses for extract_grouped_attributes
+def group_attributes_combined(tables, model=None, vertical=None, category_index=None, concurrency=1, max_output_tokens=None,
+                              explanation_tokens=400, budget_fraction=0.75):
+    if model is None:
+        model = get_stage_model('group')
+    if max_output_tokens is None:
+        max_output_tokens = st.session_state.max_tokens
+
+    attributes = combined_attribute_list(tables)
+    if category_index is not None and vertical:
+        attributes = category_index.lookup(vertical, attributes)
+    if not attributes:
+        return []
+
+    budget = max(1, int(max_output_tokens * budget_fraction) - explanation_tokens)
+    chunks = []
+    current = []
+    used = 0
+    for attribute in attributes:
+        cost = estimate_tokens(attribute) + 3
+        if current and used + cost > budget:
+            chunks.append(current)
+            current = []
+            used = 0
+        current.append(attribute)
+        used += cost
+    chunks.append(current)
+
+    def group_chunk(chunk):
+        return group_attributes(pd.DataFrame({'Attribute': chunk}), model=model,
+                                vertical=vertical, category_index=category_index)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(executor.map(group_chunk, chunks))
 # -----------------------------------------------------------------------------------------------------------S
 # Step 5: creating tables for the groups (rule based)
 
 
-def extract_grouped_attributes(response):
+# raises IndexError or ValueError when the reply has no readable dictionary or explanation
+def parse_grouping_response(response):
+    response = response.split("DICTIONARY")[1].strip()
+    dictionary = response.split("EXPLANATION")[0].strip()
+    dictionary = json.loads(dictionary)
+    explanation = response.split("EXPLANATION")[1].strip()
+    return dictionary, explanation
+
+
+def extract_grouped_attributes(response, vertical=None, attributes=None, category_index=None):
+    if isinstance(response, list):
+        return extract_combined_grouped_attributes(response, vertical, attributes, category_index)
+
+    use_index = category_index is not None and vertical
     if not response:
-        return {}, "", False
+        if not use_index or not attributes:
+            return {}, "", False
+        return category_index.group(vertical, attributes), "All attributes were grouped using the existing categories for this vertical", False
     
     errored = False
     try:
-        response = response.split("DICTIONARY")[1].strip()
-        dictionary = response.split("EXPLANATION")[0].strip()
-        dictionary = json.loads(dictionary)
-        explanation = response.split("EXPLANATION")[1].strip()
-    except:
+        dictionary, explanation = parse_grouping_response(response)
+    except (IndexError, ValueError):
         dictionary = 'could not extract dictionary'
         explanation = 'could not extract explanation'
         errored = True
 
+    # the new assignments are remembered for the vertical and the known attributes are added back
+    if use_index and not errored:
+        category_index.update(vertical, dictionary)
+        if attributes is not None:
+            dictionary = category_index.group(vertical, attributes)
+
     return dictionary, explanation, errored
 
 
-def split_tables(table, category_dict):
-    for category, attributes in category_dict.items():
-        for attribute in attributes:
-            if attribute in table['Attribute'].values:
-                table.loc[table['Attribute'] ==
-                          attribute, 'Category'] = category
+# merges the dictionaries of the chunked responses from group_attributes_combined
+def extract_combined_grouped_attributes(responses, vertical=None, attributes=None, category_index=None):
+    if not responses:
+        return extract_grouped_attributes("", vertical, attributes, category_index)
+
+    dictionary = {}
+    explanations = []
+    errored = False
+    for response in responses:
+        chunk_dictionary, explanation, chunk_errored = extract_grouped_attributes(
+            response, vertical, None, category_index)
+        if chunk_errored:
+            errored = True
+            continue
+        for category, category_attributes in chunk_dictionary.items():
+            dictionary.setdefault(category, []).extend(
+                [category_attributes] if isinstance(category_attributes, str) else category_attributes)
+        if explanation:
+            explanations.append(explanation)
+
+    if errored:
+        return 'could not extract dictionary', 'could not extract explanation', True
+    if category_index is not None and vertical and attributes is not None:
+        dictionary = category_index.group(vertical, attributes)
+    return dictionary, "\n\n".join(explanations), False
+
+
+UNASSIGNED_CATEGORY = "Uncategorized"
+
+
+# assigns every row its category with one join against an attribute -> category
+# mapping and splits the result with one groupby, the input table is left untouched.
+# An attribute listed under several categories appears in each of them, and rows whose
+# attribute isn't in any category are collected under unassigned_category (pass None to drop them)
+def split_tables(table, category_dict, unassigned_category=UNASSIGNED_CATEGORY):
+    mapping = pd.DataFrame(
+        [(attribute, category) for category, attributes in category_dict.items()
+         for attribute in ([attributes] if isinstance(attributes, str) else attributes)],
+        columns=['Attribute', 'Category']).drop_duplicates()
+
+    assigned = table.drop(columns=['Category'], errors='ignore').merge(mapping, on='Attribute', how='left')
+    categories = list(category_dict.keys())
+    if unassigned_category is not None and assigned['Category'].isna().any():
+        assigned['Category'] = assigned['Category'].fillna(unassigned_category)
+        categories.append(unassigned_category)
+
+    groups = dict(tuple(assigned.groupby('Category', sort=False)))
+    empty_table = assigned.iloc[0:0]
 
     # now split the table into those cateogries
     split_tables = {}
-    for category in category_dict.keys():
-        split_tables[category] = table[table['Category'] == category].drop(columns=[
-                                                                           'Category'])
+    for category in categories:
+        split_tables[category] = groups.get(category, empty_table).drop(
+            columns=['Category']).reset_index(drop=True)
 
     return split_tables
 # -----------------------------------------------------------------------------------------------------------S
 
 
+def stage_key(*inputs):
+    def encode(value):
+        if isinstance(value, pd.DataFrame):
+            return value.to_json()
+        return str(value)
+    payload = json.dumps(inputs, sort_keys=True, default=encode)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# runs compute with its own Metrics and keeps them in the session next to the memoized result,
+# so the summary panel always covers the latest computation of every stage
+def measure_stage(stage, step, compute):
+    def run():
+        metrics = Metrics()
+        with metrics.timed(step):
+            result = compute(metrics)
+        st.session_state.setdefault('stage_metrics', {})[stage] = metrics
+        return result
+    return run
+
+
+def stage_model(step, metrics):
+    return InstrumentedModel(get_stage_model(step), metrics, step)
+
+
+def parse_failure_counter(step, metrics):
+    return lambda count: metrics.add(step, 'parse_failures', count)
+
+
+# keeps the latest result of each stage in the session, keyed on the stage inputs,
+# so a rerun only recomputes the stages whose inputs changed
+def memoize_stage(stage, inputs, compute):
+    key = stage_key(*inputs)
+    results = st.session_state.setdefault('stage_results', {})
+    if stage in results and results[stage][0] == key:
+        return results[stage][1]
+    result = compute()
+    results[stage] = (key, result)
+    return result
+
+
+# summary of where the time and tokens of the latest computation of every stage went
+def show_metrics_summary(stage_metrics):
+    metrics = Metrics()
+    for stage_result in stage_metrics:
+        metrics.merge(stage_result)
+    snapshot = metrics.snapshot()
+    steps = [step for step in ['extract', 'canonicalize', 'compare', 'merge', 'group', 'split'] if step in snapshot]
+    summary = pd.DataFrame([snapshot[step] for step in steps], index=steps)
+    summary.loc['total'] = summary.sum()
+    with st.expander('Performance summary'):
+        st.dataframe(summary.style.format(precision=2))
+
+
+def run_pipeline(description, review_source, vertical="", source_key=None, product_id=""):
+    model_config = st.session_state.get('model_config') or {}
+    st.divider()
+
+    st.header('Results from the different steps of the pipeline')
+
+    # ----------------------------------------------------------------------------------------------------
+    # Extract descriptive details from the review
+    st.markdown('### :red[Step 1:] Descriptive details extracted from the review')
+    st.markdown(
+        '##### :gray[The extracted descriptive details from the review are shown below]')
+    with st.expander('Details'):
+        st.write('The descriptive details are the specific attributes of the product that are mentioned in the review. These attributes could be dimensions, size, color, materials, or specific functionalities of the product. It is important to ensure that we include attributes only about the product. The extracted details are shown below in the form of a table with the key and the attribute as columns.')
+
+    if source_key is None:
+        source_key = source_digest(review_source)
+
+    def extract(metrics):
+        extraction_progress = st.progress(0, text='Extracting descriptive details from the reviews')
+        live_results = st.empty()
+        live_container = live_results.container()
+        reader_errors = []
+        representatives = []
+        assignments = []
+        hashes = []
+        duplicates = DuplicateIndex(st.session_state.dedup_threshold) if st.session_state.deduplicate else None
+        # reviews extracted in an earlier run of the same product, with the same model and
+        # prompt, are not sent again
+        store_config = config_key(model_config.get('extract') or {}, EXTRACTION_PROMPT_VERSION,
+                                  batched=st.session_state.batch_extraction)
+        stored_details = get_result_store().get_extractions(product_id, store_config) if product_id else {}
+
+        # reviews are parsed and clustered one at a time, only the first review of each cluster of
+        # near duplicates goes to the model, so extraction starts before the whole input is read
+        def unique_reviews():
+            for i, text in enumerate(iter_reviews(review_source, reader_errors)):
+                hashes.append(review_hash(text))
+                if hashes[-1] in stored_details:
+                    assignments.append(None)
+                    continue
+                assignments.append(len(representatives) if duplicates is None else duplicates.add(i, text))
+                if assignments[-1] == len(representatives):
+                    representatives.append(i)
+                    yield text
+
+        def update_extraction_progress(done, total):
+            extraction_progress.progress(
+                done / total, text=f'Extracted descriptive details from review {done} of {total}')
+
+        def show_extracted_review(i, details):
+            live_container.caption(f'Review {representatives[i]+1}')
+            live_container.write(clean_descriptive_details([details])[0])
+
+        descriptive_details = extract_descriptive_details_from_reviews(
+            unique_reviews(), model=stage_model('extract', metrics), concurrency=st.session_state.concurrency,
+            progress=update_extraction_progress, batched=st.session_state.batch_extraction,
+            on_result=show_extracted_review if st.session_state.stream_results else None,
+            on_parse_failure=parse_failure_counter('extract', metrics))
+        extraction_progress.empty()
+        live_results.empty()
+        # like in the batch runner a blocked extraction stops the run, nothing is stored or memoized
+        if descriptive_details == "Safety Error!":
+            st.error('The model blocked the response for at least one review, so the descriptive details could not be extracted. Please check the reviews and try again.')
+            st.stop()
+        # the results of each representative are copied back to every review of its cluster
+        descriptive_details = clean_descriptive_details(descriptive_details)
+        new_details = {hashes[i]: descriptive_details[representative]
+                       for i, representative in enumerate(assignments) if representative is not None}
+        if product_id and new_details:
+            get_result_store().put_extractions(product_id, store_config, new_details)
+        stored_details.update(new_details)
+        return [stored_details[key] for key in hashes], representatives, assignments, reader_errors
+
+    descriptive_details, representatives, assignments, reader_errors = memoize_stage(
+        'extract', [source_key, model_config.get('extract'), st.session_state.batch_extraction, st.session_state.deduplicate,
+                    st.session_state.dedup_threshold, product_id], measure_stage('extract', 'extract', extract))
+    if reader_errors:
+        with st.expander(f':orange[{len(reader_errors)} malformed review entries were skipped]'):
+            st.dataframe(pd.DataFrame(reader_errors))
+    reused = assignments.count(None)
+    if reused:
+        st.info(f'{reused} of {len(assignments)} reviews were already extracted in an earlier run of product {product_id}')
+    if len(representatives) < len(assignments) - reused:
+        st.info(f'{len(assignments) - reused} new reviews, {len(representatives)} unique after removing near duplicates')
+
+    # variant spellings of the same attribute are collapsed locally before they reach the comparison
+    if st.session_state.canonicalize_attributes:
+        descriptive_details, canonicalization_audit = memoize_stage(
+            'canonicalize', [descriptive_details],
+            measure_stage('canonicalize', 'canonicalize',
+                          lambda metrics: canonicalize_descriptive_details(descriptive_details, get_synonym_table())))
+    st.write(descriptive_details)
+    if st.session_state.canonicalize_attributes and canonicalization_audit:
+        with st.expander(f'{len(canonicalization_audit)} attributes renamed to their canonical form'):
+            st.dataframe(pd.DataFrame(canonicalization_audit))
+
+    # ----------------------------------------------------------------------------------------------------
+    # Compare with seller description
+    st.markdown('### :red[Step 2:] Comparison with seller description')
+    st.markdown(
+        '##### :gray[The comparison of the extracted descriptive details from the review with the seller description is shown below]')
+    with st.expander('Details'):
+        st.write('The comparison table shows the missing information, contradictory information, matching information, partially matching information, and opinion-based information between the extracted details from the review and the seller description. The table shows the key, attribute, and the status of the information (missing, contradictory, matching, partially matching, or opinion).')
+
+    def compare(metrics):
+        live_results = st.empty()
+        live_container = live_results.container()
+        live_tables = {}
+
+        # each review gets its own table as soon as its first row arrives
+        def show_compared_row(review_number, row):
+            if review_number not in live_tables:
+                live_container.markdown(f'#### :gray[Output table for Review {review_number}]')
+                live_tables[review_number] = (live_container.empty(), [])
+            placeholder, rows = live_tables[review_number]
+            rows.append(row)
+            placeholder.dataframe(pd.DataFrame(rows, columns=["Attribute", "Value", "Description"]))
+
+        # reviews with the same details, like a cluster of near duplicates, are compared once, and
+        # details already compared with this description in an earlier run are not compared again
+        store_config = config_key(model_config.get('compare') or {}, COMPARISON_PROMPT_VERSION,
+                                  prematch=st.session_state.prematch)
+        stored_tables = get_result_store().get_comparisons(product_id, description, store_config) if product_id else None
+        review_tables, new_tables = compare_distinct_details(
+            description, reviews, stored_tables, on_row=show_compared_row if st.session_state.stream_results else None,
+            model=stage_model('compare', metrics), concurrency=st.session_state.concurrency,
+            repair_attempts=st.session_state.repair_attempts, prematch=st.session_state.prematch,
+            on_parse_failure=parse_failure_counter('compare', metrics))
+        live_results.empty()
+        if product_id and new_tables:
+            get_result_store().put_comparisons(product_id, description, store_config, new_tables)
+        return review_tables
+
+    reviews = descriptive_details
+    review_tables = memoize_stage(
+        'compare', [description, reviews, model_config.get('compare'), st.session_state.repair_attempts, st.session_state.prematch,
+                    product_id],
+        measure_stage('compare', 'compare', compare))
+    parsed_review_tables = parse_review_tables(review_tables)
+    pretty_review_tables = pretty_print_review_tables(parsed_review_tables)
+    for i, pretty_table in enumerate(pretty_review_tables):
+        st.markdown(f'#### :gray[Output table for Review {i+1}]')
+        # add the highlight function to the table
+        pretty_table = pretty_table.style.applymap(
+            highlight, subset=['Description'])
+        st.dataframe(pretty_table)
+
+    # ----------------------------------------------------------------------------------------------------
+    # Merge tables
+    def merge(metrics):
+        merged = merge_tables(parsed_review_tables)
+        metrics.add('merge', 'parse_failures', len(merged[-1]))
+        return merged
+
+    missing_info, contradictory_info, partially_matching_info, error_log = memoize_stage(
+        'merge', [review_tables], measure_stage('merge', 'merge', merge))
+    st.markdown('### :red[Step 3:] Merged tables as per category')
+    st.markdown(
+        '##### :gray[The merged table shows the missing and contradictory information across all reviews]')
+    with st.expander('Details'):
+        st.write('The merged table shows the missing and contradictory information across all reviews. The table has three columns - the first column contains the key from the review, the second column contains the attribute from the review, and the last column mentions the review number.')
+    st.markdown('#### :gray[Missing information]')
+    st.dataframe(missing_info)
+    st.markdown('#### :gray[Contradictory information]')
+    st.dataframe(contradictory_info)
+    st.markdown('#### :gray[Partially matching information]')
+    st.dataframe(partially_matching_info)
+    if error_log:
+        with st.expander(f':orange[{len(error_log)} lines of the comparison tables could not be parsed]'):
+            st.code('\n'.join(str(line) for line in error_log))
+
+    # ----------------------------------------------------------------------------------------------------
+    # group attributes
+    category_index = get_category_index() if vertical else None
+    st.markdown('### :red[Step 4:] Group attributes into categories')
+    st.markdown('##### :gray[The attributes from each table are grouped according to the categories they belong to and the explanation behind the grouping is provided]')
+    with st.expander('Details'):
+        st.write('The attributes from each table are grouped according to the categories they belong to and the explanation behind the grouping is provided. The output is in the form of a dictionary where the key is the category name and the value is a list of attributes that belong to that category. Additionally, the explanation behind why the attributes were grouped into those categories is also provided.')
+
+    if st.session_state.combined_grouping:
+        # one request for the union of the attributes of the three tables, the single
+        # dictionary it returns is applied to each of them in Step 5
+        merged_infos = [missing_info, contradictory_info, partially_matching_info]
+        combined_info_attr = memoize_stage(
+            'group combined', [merged_infos, model_config.get('group'), vertical],
+            measure_stage('group combined', 'group', lambda metrics: group_attributes_combined(
+                merged_infos, model=stage_model('group', metrics), vertical=vertical, category_index=category_index,
+                concurrency=st.session_state.concurrency)))
+        combined_info_dict, combined_info_explanation, combined_error = extract_grouped_attributes(
+            combined_info_attr, vertical=vertical, attributes=combined_attribute_list(merged_infos),
+            category_index=category_index)
+        st.markdown('#### :gray[Combined Dictionary:]')
+        st.write(combined_info_dict)
+        st.markdown('#### :gray[Combined Explanation:]')
+        st.write(combined_info_explanation)
+
+        missing_info_dict = contradictory_info_dict = partially_matching_info_dict = combined_info_dict
+        missing_error = contra_error = partially_match_error = combined_error
+        grouping_failures = int(combined_error)
+    else:
+        missing_info_attr = memoize_stage(
+            'group missing', [missing_info, model_config.get('group'), vertical],
+            measure_stage('group missing', 'group', lambda metrics: group_attributes(
+                missing_info, model=stage_model('group', metrics), vertical=vertical, category_index=category_index)))
+        contradictory_info_attr = memoize_stage(
+            'group contradictory', [contradictory_info, model_config.get('group'), vertical],
+            measure_stage('group contradictory', 'group', lambda metrics: group_attributes(
+                contradictory_info, model=stage_model('group', metrics), vertical=vertical, category_index=category_index)))
+        partially_matching_info_attr = memoize_stage(
+            'group partially matching', [partially_matching_info, model_config.get('group'), vertical],
+            measure_stage('group partially matching', 'group', lambda metrics: group_attributes(
+                partially_matching_info, model=stage_model('group', metrics), vertical=vertical, category_index=category_index)))
+
+        missing_info_dict, missing_info_explanation, missing_error = extract_grouped_attributes(
+            missing_info_attr, vertical=vertical, attributes=list(missing_info['Attribute']), category_index=category_index)
+        st.markdown('#### :gray[Missing information Dictionary:]')
+        st.write(missing_info_dict)
+        st.markdown('#### :gray[Missing information Explanation:]')
+        st.write(missing_info_explanation)
+
+        contradictory_info_dict, contradictory_info_explanation, contra_error = extract_grouped_attributes(
+            contradictory_info_attr, vertical=vertical, attributes=list(contradictory_info['Attribute']), category_index=category_index)
+        st.markdown('#### :gray[Contradictory information Dictionary:]')
+        st.write(contradictory_info_dict)
+        st.markdown('#### :gray[Contradictory information Explanation:]')
+        st.write(contradictory_info_explanation)
+
+        partially_matching_info_dict, partially_matching_info_explanation, partially_match_error = extract_grouped_attributes(
+            partially_matching_info_attr, vertical=vertical, attributes=list(partially_matching_info['Attribute']), category_index=category_index)
+        st.markdown('#### :gray[Partially matching information Dictionary:]')
+        st.write(partially_matching_info_dict)
+        st.markdown('#### :gray[Partially matching information Explanation:]')
+        st.write(partially_matching_info_explanation)
+        grouping_failures = int(missing_error) + int(contra_error) + int(partially_match_error)
+    # ----------------------------------------------------------------------------------------------------
+    # split tables
+    split_metrics = Metrics()
+    split_start = time.perf_counter()
+    split_metrics.add('group', 'parse_failures', grouping_failures)
+    st.subheader('Step 5: Split tables into categories')
+    st.markdown(
+        '##### The tables are split into categories based on the grouped attributes')
+    with st.expander('Details'):
+        st.write('The tables are split into categories based on the grouped attributes. The tables are split into different categories and the attributes are grouped accordingly.')
+    st.markdown('#### Missing information')
+    if not missing_error:
+        missing_fin = split_tables(missing_info, missing_info_dict)
+        for category, table in missing_fin.items():
+            # a combined dictionary has categories without attributes in this table
+            if table.empty:
+                continue
+            st.markdown(f'##### :gray[{category}]')
+            st.dataframe(table)
+
+    st.markdown('#### Contradictory information')
+    if not contra_error:
+        contradictory_fin = split_tables(
+            contradictory_info, contradictory_info_dict)
+        for category, table in contradictory_fin.items():
+            if table.empty:
+                continue
+            st.markdown(f'##### :gray[{category}]')
+            st.dataframe(table)
+
+    st.markdown('#### Partially matching information')
+    if not partially_match_error:
+        partially_matching_fin = split_tables(
+            partially_matching_info, partially_matching_info_dict)
+        for category, table in partially_matching_fin.items():
+            if table.empty:
+                continue
+            st.markdown(f'##### :gray[{category}]')
+            st.dataframe(table)
+
+    split_metrics.add('split', 'seconds', time.perf_counter() - split_start)
+    st.session_state.setdefault('stage_metrics', {})['split'] = split_metrics
+
+    cache_stats = get_response_cache().stats()
+    st.caption(
+        f"LLM response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries stored")
+    # stages left over from other settings, like the per table grouping after switching to combined, are not shown
+    active_stages = ['extract', 'canonicalize' if st.session_state.canonicalize_attributes else None, 'compare', 'merge']
+    active_stages += ['group combined'] if st.session_state.combined_grouping else [
+        'group missing', 'group contradictory', 'group partially matching']
+    stage_metrics = st.session_state['stage_metrics']
+    show_metrics_summary([stage_metrics[stage] for stage in active_stages + ['split'] if stage in stage_metrics])
+
+
+# renders a result computed by the service, the same steps as run_pipeline without the model calls
+def show_job_result(result):
+    st.divider()
+    st.header('Results from the different steps of the pipeline')
+
+    st.markdown('### :red[Step 1:] Descriptive details extracted from the review')
+    st.write(result['descriptive_details'])
+
+    st.markdown('### :red[Step 2:] Comparison with seller description')
+    for i, pretty_table in enumerate(pretty_print_review_tables(parse_review_tables(result['review_tables']))):
+        st.markdown(f'#### :gray[Output table for Review {i+1}]')
+        st.dataframe(pretty_table.style.applymap(highlight, subset=['Description']))
+
+    st.markdown('### :red[Step 3:] Merged tables as per category')
+    table_labels = {'missing': 'Missing information', 'contradictory': 'Contradictory information',
+                    'partially_matching': 'Partially matching information'}
+    for name, label in table_labels.items():
+        st.markdown(f'#### :gray[{label}]')
+        st.dataframe(pd.DataFrame(result['merged'][name], columns=['Attribute', 'Value', 'Review number']))
+    error_log = result['merged']['error_log']
+    if error_log:
+        with st.expander(f':orange[{len(error_log)} lines of the comparison tables could not be parsed]'):
+            st.code('\n'.join(str(line) for line in error_log))
+
+    st.markdown('### :red[Step 4:] Group attributes into categories')
+    for name, label in table_labels.items():
+        grouped = result['grouped'][name]
+        st.markdown(f'#### :gray[{label} Dictionary:]')
+        st.write(grouped['categories'])
+        st.markdown(f'#### :gray[{label} Explanation:]')
+        st.write(grouped['explanation'])
+
+    st.subheader('Step 5: Split tables into categories')
+    for name, label in table_labels.items():
+        st.markdown(f'#### {label}')
+        for category, records in result['grouped'][name]['tables'].items():
+            st.markdown(f'##### :gray[{category}]')
+            st.dataframe(pd.DataFrame(records))
+
+    summary = pd.DataFrame(result.get('metrics') or []).drop(columns=['stage'], errors='ignore')
+    if not summary.empty:
+        summary.index = [record['stage'] for record in result['metrics']]
+        summary.loc['total'] = summary.sum()
+        with st.expander('Performance summary'):
+            st.dataframe(summary.style.format(precision=2))
+
+
+# polls the service until the job is finished, the job keeps running if the page is closed
+# and its result can be shown again later from its ID
+def show_service_job(job):
+    st.caption(f"Job {job['job_id']} on {job['url']}")
+    if 'result' not in job:
+        try:
+            status = job_status(job['url'], job['job_id'])
+            if status['status'] == 'failed':
+                st.error(f"The job failed: {status['error']}")
+                return
+            if status['status'] != 'done':
+                st.info(f"The job is {status['status']}, this page refreshes until it is done")
+                time.sleep(2)
+                st.rerun()
+            job['result'] = job_result(job['url'], job['job_id'])
+        except ServiceError as e:
+            st.error(f'Error talking to the service: {e}')
+            return
+    show_job_result(job['result'])
+
+
 def main():
     st.set_page_config(page_title='PRAISE', layout='wide')
     st.markdown('''# :red[PRAISE]: :red[P]roduct :red[R]eview :red[A]ttribute :red[I]nsight :red[S]tructuring :red[E]ngine''')
     st.markdown('## Initial Model Configuration')
-    model_selection = st.selectbox('Select your preferred language model', [
-                                   'Select model', 'Gemini 1.5 Pro', 'GPT-3.5', 'GPT-4', 'Llama 3.0 70B'])
+    with st.expander("Details"):
+        st.write("With the URL of a PRAISE service (python service.py) the reviews are sent to it as a job and this page only shows the result. The service runs the jobs of every user on its own pool of workers with its own model configuration, and a job keeps running if this page is closed. Leave it empty to run the pipeline in this session with the configuration below")
+    service_url = st.text_input('Enter the URL of a PRAISE service, or leave it empty to run the pipeline here', '').strip()
+    # each stage can run on its own model, the simpler extraction and grouping default to the faster tier
+    stage_models = {}
+    for stage in STAGES:
+        labels = list(MODEL_CHOICES)
+        default = labels.index(next(label for label, name in MODEL_CHOICES.items()
+                                    if name == DEFAULT_STAGE_MODELS[stage]))
+        label = st.selectbox(f'Select the language model for {STAGE_LABELS[stage]}', labels, index=default)
+        stage_models[stage] = MODEL_CHOICES[label]
+    if REPLAY_BACKEND in stage_models.values():
+        st.session_state.replay_path = st.text_input(
+            'Enter the path of the JSONL file with the recorded responses', 'praise_recordings.jsonl')
+        st.session_state.replay_latency = st.slider(
+            'Select the simulated latency of each replayed response in seconds', 0.0, 10.0, 0.0)
     hyperparameters()
 
-    if model_selection == 'Select model':
-        st.write('Please select a model to proceed')
-    else:
-        if st.button('Configure model'):
-            if model_selection == 'Gemini 1.5 Pro':
-                model = gemini_setup(st.session_state.temp,
-                                     st.session_state.max_tokens)
-                st.session_state.model = model
-                st.success('Model configured successfully')
-            else:
-                st.error(
-                    'We currently on support Gemini 1.5 Pro, more models will be added soon.')
-                
+    if st.button('Configure model'):
+        st.session_state.models = stage_models_setup(stage_models, st.session_state.temp,
+                                                     st.session_state.max_tokens)
+        st.session_state.model_config = {
+            stage: {'model': model_name, 'temperature': st.session_state.temp, 'max_tokens': st.session_state.max_tokens}
+            for stage, model_name in stage_models.items()}
+        st.success('Model configured successfully')
+
     st.divider()
 
     st.markdown('## Enter details of the product')
@@ -412,6 +1396,16 @@ def main():
         st.write("The description of the product helps us know that the product listing states already, and helps us ground what additional information we can extract from the reviews. This is often the seller provided description that we can see in e-commerce websites. For example, here is a possible description for a laptop: This is a 13-inch laptop with a 4K display, 16GB RAM, and 512GB SSD storage. Please ensure that the description is in the form of a plain text")
     description = st.text_area("Enter description here", "")
 
+    st.markdown('### Enter the product vertical')
+    with st.expander("Details"):
+        st.write("The vertical is the kind of product, for example laptops or t-shirts. Attributes that were already grouped for products of the same vertical keep their category, and only new attributes are sent to the model in Step 4. Leave it empty to group every attribute from scratch")
+    vertical = st.text_input("Enter vertical here", "").strip().lower()
+
+    st.markdown('### Enter the product ID')
+    with st.expander("Details"):
+        st.write("The product ID identifies the product across runs. The extraction of every review and its comparison with the description are stored under it, so submitting the product again with new reviews only sends the new reviews to the model. A changed description only recomputes the comparisons. Leave it empty to process every review from scratch")
+    product_id = st.text_input("Enter product ID here", "").strip()
+
     st.subheader("Enter the review(s) of the product")
     with st.expander("Details"):
         st.write("The reviews of the product is the list of comments given by users of the product. You can enter the review(s) in the text area below or upload a json file with the review(s). The reviews should be in the format of plain JSON only, where each entry of the review is a separate JSON object with the key 'review:'. Here are a few possible examples for how the reviews should be formatted. Please ensure that this formatting is strictly followed")
@@ -423,131 +1417,60 @@ def main():
         st.write(
             "Please ensure that the same format is followed for review in both input or the file")
     review_text = st.text_area("Enter review(s) here", "")
-    review_file = st.file_uploader("Alternatively you can upload a json file with the review(s)", type=['json'])
+    review_file = st.file_uploader("Alternatively you can upload a json or jsonl file with the review(s)", type=['json', 'jsonl'])
+
+    if service_url:
+        earlier_job = st.text_input('Alternatively enter the ID of an earlier job to show its result', '').strip()
+        # only a newly entered ID switches jobs, the field stays filled and must not swap a
+        # job submitted afterwards back to the earlier one
+        if earlier_job and earlier_job != st.session_state.get('applied_earlier_job'):
+            st.session_state.applied_earlier_job = earlier_job
+            st.session_state.job = {'url': service_url, 'job_id': earlier_job}
+            st.session_state.pop('submitted', None)
 
     if st.button('Submit'):
+        # the reviews are not parsed here, the pipeline reads them incrementally as it extracts
+        review_source = None
         if review_file:
-            reviews = json.load(review_file)
+            review_source = review_file
             st.info("Obtained a json file with the review(s)")
         elif review_text:
-            reviews = json.loads(review_text)
+            review_source = review_text
             st.info("Obtained the review(s) from the text area")
         else:
             st.write(
                 "Please provide the review(s) in the text area or upload a json file")
 
-        review = []
-        for r in reviews:
-            review.append(r['review'])
-        
+        if review_source is not None and service_url:
+            reader_errors = []
+            reviews = list(iter_reviews(review_source, reader_errors))
+            if reader_errors:
+                st.warning(f'{len(reader_errors)} malformed review entries were skipped')
+            try:
+                job_id = submit_job(service_url, description, reviews, vertical, product_id)
+            except ServiceError as e:
+                st.error(f'Error submitting the job: {e}')
+            else:
+                st.session_state.job = {'url': service_url, 'job_id': job_id}
+                st.session_state.pop('submitted', None)
+        elif review_source is not None:
+            st.session_state.submitted = {"description": description, "reviews": review_source,
+                                          "reviews_key": source_digest(review_source), "product_id": product_id}
+            st.session_state.pop('job', None)
+
+    # streamlit reruns main() on every widget interaction, the submitted inputs are
+    # kept in the session and every stage is memoized, so re-rendering costs no api calls
+    if "job" in st.session_state:
+        show_service_job(st.session_state.job)
+    elif "submitted" in st.session_state:
         with st.spinner('Processing the reviews'):
-            st.divider()
-
-            st.header('Results from the different steps of the pipeline')
-
-            # ----------------------------------------------------------------------------------------------------
-            # Extract descriptive details from the review
-            descriptive_details = extract_descriptive_details_from_reviews(review)
-            descriptive_details = clean_descriptive_details(descriptive_details)
-            st.markdown('### :red[Step 1:] Descriptive details extracted from the review')
-            st.markdown(
-                '##### :gray[The extracted descriptive details from the review are shown below]')
-            with st.expander('Details'):
-                st.write('The descriptive details are the specific attributes of the product that are mentioned in the review. These attributes could be dimensions, size, color, materials, or specific functionalities of the product. It is important to ensure that we include attributes only about the product. The extracted details are shown below in the form of a table with the key and the attribute as columns.')
-            st.write(descriptive_details)
-
-            # ----------------------------------------------------------------------------------------------------
-            # Compare with seller description
-            reviews = descriptive_details
-            review_tables = run_compare(description, reviews)
-            st.markdown('### :red[Step 2:] Comparison with seller description')
-            st.markdown(
-                '##### :gray[The comparison of the extracted descriptive details from the review with the seller description is shown below]')
-            with st.expander('Details'):
-                st.write('The comparison table shows the missing information, contradictory information, matching information, partially matching information, and opinion-based information between the extracted details from the review and the seller description. The table shows the key, attribute, and the status of the information (missing, contradictory, matching, partially matching, or opinion).')
-            pretty_review_tables = pretty_print_review_tables(review_tables)
-            for i, pretty_table in enumerate(pretty_review_tables):
-                st.markdown(f'#### :gray[Output table for Review {i+1}]')
-                # add the highlight function to the table
-                pretty_table = pretty_table.style.applymap(
-                    highlight, subset=['Description'])
-                st.dataframe(pretty_table)
-
-            # ----------------------------------------------------------------------------------------------------
-            # Merge tables
-            missing_info, contradictory_info, partially_matching_info, error_log = merge_tables(
-                review_tables)
-            st.markdown('### :red[Step 3:] Merged tables as per category')
-            st.markdown(
-                '##### :gray[The merged table shows the missing and contradictory information across all reviews]')
-            with st.expander('Details'):
-                st.write('The merged table shows the missing and contradictory information across all reviews. The table has three columns - the first column contains the key from the review, the second column contains the attribute from the review, and the last column mentions the review number.')
-            st.markdown('#### :gray[Missing information]')
-            st.dataframe(missing_info)
-            st.markdown('#### :gray[Contradictory information]')
-            st.dataframe(contradictory_info)
-            st.markdown('#### :gray[Partially matching information]')
-            st.dataframe(partially_matching_info)
-
-            # ----------------------------------------------------------------------------------------------------
-            # group attributes
-            missing_info_attr = group_attributes(missing_info)
-            contradictory_info_attr = group_attributes(contradictory_info)
-            partially_matching_info_attr = group_attributes(partially_matching_info)
-            st.markdown('### :red[Step 4:] Group attributes into categories')
-            st.markdown('##### :gray[The attributes from each table are grouped according to the categories they belong to and the explanation behind the grouping is provided]')
-            with st.expander('Details'):
-                st.write('The attributes from each table are grouped according to the categories they belong to and the explanation behind the grouping is provided. The output is in the form of a dictionary where the key is the category name and the value is a list of attributes that belong to that category. Additionally, the explanation behind why the attributes were grouped into those categories is also provided.')
-
-            missing_info_dict, missing_info_explanation, missing_error = extract_grouped_attributes(
-                missing_info_attr)
-            st.markdown('#### :gray[Missing information Dictionary:]')
-            st.write(missing_info_dict)
-            st.markdown('#### :gray[Missing information Explanation:]')
-            st.write(missing_info_explanation)
-
-            contradictory_info_dict, contradictory_info_explanation, contra_error = extract_grouped_attributes(
-                contradictory_info_attr)
-            st.markdown('#### :gray[Contradictory information Dictionary:]')
-            st.write(contradictory_info_dict)
-            st.markdown('#### :gray[Contradictory information Explanation:]')
-            st.write(contradictory_info_explanation)
-
-            partially_matching_info_dict, partially_matching_info_explanation, partially_match_error = extract_grouped_attributes(
-                partially_matching_info_attr)
-            st.markdown('#### :gray[Partially matching information Dictionary:]')
-            st.write(partially_matching_info_dict)
-            st.markdown('#### :gray[Partially matching information Explanation:]')
-            st.write(partially_matching_info_explanation)
-            # ----------------------------------------------------------------------------------------------------
-            # split tables
-            st.subheader('Step 5: Split tables into categories')
-            st.markdown(
-                '##### The tables are split into categories based on the grouped attributes')
-            with st.expander('Details'):
-                st.write('The tables are split into categories based on the grouped attributes. The tables are split into different categories and the attributes are grouped accordingly.')
-            st.markdown('#### Missing information')
-            if not missing_error:
-                missing_fin = split_tables(missing_info, missing_info_dict)
-                for category, table in missing_fin.items():
-                    st.markdown(f'##### :gray[{category}]')
-                    st.dataframe(table)
-
-            st.markdown('#### Contradictory information')
-            if not contra_error:
-                contradictory_fin = split_tables(
-                    contradictory_info, contradictory_info_dict)
-                for category, table in contradictory_fin.items():
-                    st.markdown(f'##### :gray[{category}]')
-                    st.dataframe(table)
-
-            st.markdown('#### Partially matching information')
-            if not partially_match_error:
-                partially_matching_fin = split_tables(
-                    partially_matching_info, partially_matching_info_dict)
-                for category, table in partially_matching_fin.items():
-                    st.markdown(f'##### :gray[{category}]')
-                    st.dataframe(table)
+            try:
+                run_pipeline(st.session_state.submitted["description"], st.session_state.submitted["reviews"],
+                             vertical, st.session_state.submitted["reviews_key"], st.session_state.submitted["product_id"])
+            except Exception as e:
+                # blocked responses show up as Safety Error! in the stage, this is anything else,
+                # like a network error, an exhausted quota or an open circuit
+                st.error(f'The pipeline stopped with an error: {e}')
 
 
 if __name__ == '__main__':
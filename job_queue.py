@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+DEFAULT_QUEUE_PATH = os.path.join('.praise_cache', 'jobs.sqlite')
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATUSES = [QUEUED, RUNNING, DONE, FAILED]
+
+
+# SQLite backed queue of pipeline jobs shared by the service and its worker processes, every
+# process opens its own connection. A job is claimed with a single UPDATE, so two workers never
+# run the same job, and jobs of a worker that died are put back in the queue
+class JobQueue:
+    def __init__(self, path=DEFAULT_QUEUE_PATH, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, started_at REAL, finished_at REAL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+        self._conn.commit()
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                               (job_id, QUEUED, json.dumps(payload), time.time()))
+            self._conn.commit()
+        return job_id
+
+    # marks the oldest queued job as running on worker and returns (job id, payload), or None
+    def claim(self, worker):
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started_at = ? WHERE id = "
+                "(SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) RETURNING id, payload",
+                (RUNNING, worker, time.time(), QUEUED)).fetchone()
+            self._conn.commit()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=str(error))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                               (status, result, error, time.time(), job_id))
+            self._conn.commit()
+
+    # running jobs of the given worker, or of every worker, go back in the queue unless they
+    # already took max_attempts tries, since a job that keeps killing its worker would block it.
+    # Jobs stopped on purpose, by a shutdown, pass count_attempt=False and get their attempt back
+    def requeue(self, worker=None, count_attempt=True):
+        condition = "status = ?" + (" AND worker = ?" if worker is not None else "")
+        parameters = (RUNNING,) + ((worker,) if worker is not None else ())
+        with self._lock:
+            if count_attempt:
+                self._conn.execute(
+                    f"UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE {condition} AND attempts >= ?",
+                    (FAILED, "the worker running the job stopped", time.time()) + parameters + (self.max_attempts,))
+            requeued = self._conn.execute(
+                f"UPDATE jobs SET status = ?, worker = NULL, attempts = attempts - ? WHERE {condition}",
+                (QUEUED, 0 if count_attempt else 1) + parameters).rowcount
+            self._conn.commit()
+        return requeued
+
+    def status(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, error, attempts, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, error, attempts, created_at, started_at, finished_at = row
+        return {"job_id": job_id, "status": status, "error": error, "attempts": attempts,
+                "created_at": created_at, "started_at": started_at, "finished_at": finished_at}
+
+    def result(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ? AND status = ?", (job_id, DONE)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import record_call_event
+
+
+DEFAULT_CACHE_PATH = os.path.join('.praise_cache', 'responses.sqlite')
+
+
+# disk backed cache of model responses, keyed on everything that influences the
+# output: the model name, the generation config and the full list of prompt parts
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=256 * 1024 * 1024, max_age=30 * 24 * 3600, evict_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._conn.commit()
+
+    # options are the generate_content keyword arguments, like safety_settings or a per call
+    # generation_config. stream only changes how the text arrives, so it is left out
+    @staticmethod
+    def make_key(model_name, generation_config, prompt_parts, options=None):
+        key = {
+            "model": model_name,
+            "temperature": generation_config.get("temperature"),
+            "max_output_tokens": generation_config.get("max_output_tokens"),
+            "prompt": [str(part) for part in prompt_parts],
+        }
+        options = {name: value for name, value in (options or {}).items() if name != "stream"}
+        if options:
+            key["options"] = options
+        payload = json.dumps(key, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, text):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                               (key, text, len(text.encode('utf-8')), now, now))
+            self._conn.commit()
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict(now)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now):
+        # drop expired entries first, then the least recently used ones until
+        # the cache fits in its size budget again
+        if self.max_age is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        if self.max_bytes is not None:
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+class CachedResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+# drop-in wrapper around a model that routes every generate_content call through the cache.
+# A call with cache=False goes straight to the model and its reply is not stored, for
+# repairs that must not get the rejected reply back
+class CachedModel:
+    def __init__(self, model, cache, model_name, generation_config):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def generate_content(self, prompt_parts, **kwargs):
+        if not kwargs.pop("cache", True):
+            return self.model.generate_content(prompt_parts, **kwargs)
+        key = self.cache.make_key(
+            self.model_name, self.generation_config, prompt_parts, kwargs)
+        text = self.cache.get(key)
+        if text is not None:
+            record_call_event("cache_hits")
+            response = CachedResponse(text)
+            # a cached streaming response arrives as a single chunk
+            return [response] if kwargs.get("stream") else response
+
+        response = self.model.generate_content(prompt_parts, **kwargs)
+        if kwargs.get("stream"):
+            return self._stream_and_store(key, response)
+        try:
+            text = response.text
+        except Exception:
+            # blocked responses have no text, leave them for the caller to handle
+            return response
+        self.cache.put(key, text)
+        return response
+
+    # drops the stored reply of a call, for replies that were rejected after they were cached
+    def invalidate(self, prompt_parts, **kwargs):
+        kwargs.pop("cache", None)
+        self.cache.delete(self.cache.make_key(
+            self.model_name, self.generation_config, prompt_parts, kwargs))
+
+    def _stream_and_store(self, key, response):
+        chunks = []
+        for chunk in response:
+            chunks.append(chunk.text)
+            yield chunk
+        # only a fully consumed stream is stored
+        self.cache.put(key, "".join(chunks))
+
+
+# the CachedModel may sit below other wrappers like InstrumentedModel, every wrapper keeps the
+# model it wraps in .model. Models without a cache have nothing to drop
+def invalidate_cached_response(model, prompt_parts, **kwargs):
+    while model is not None:
+        if isinstance(model, CachedModel):
+            model.invalidate(prompt_parts, **kwargs)
+            return
+        model = getattr(model, "model", None)
@@ -0,0 +1,144 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+FIELDS = ["seconds", "calls", "call_seconds", "prompt_tokens", "output_tokens", "retries", "cache_hits",
+          "parse_failures", "errors"]
+
+# help text of the exported prometheus metrics
+FIELD_HELP = {
+    "seconds": "Wall time spent in the stage",
+    "calls": "Model calls made by the stage",
+    "call_seconds": "Time spent waiting on model calls, summed over concurrent calls",
+    "prompt_tokens": "Prompt tokens sent to the model",
+    "output_tokens": "Output tokens returned by the model",
+    "retries": "Model calls retried after a transient error",
+    "cache_hits": "Model calls answered from the response cache",
+    "parse_failures": "Model outputs or rows that could not be parsed",
+    "errors": "Model calls that raised",
+}
+
+# the model call running in each thread, so the retry and cache layers below the
+# instrumented model can attribute their events to it
+_local = threading.local()
+
+
+# per stage counters of one pipeline run, safe to update from the worker threads
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, stage, field, amount=1):
+        with self._lock:
+            values = self._stages.setdefault(stage, dict.fromkeys(FIELDS, 0))
+            values[field] += amount
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, "seconds", time.perf_counter() - start)
+
+    def merge(self, other):
+        for stage, values in other.snapshot().items():
+            for field, amount in values.items():
+                self.add(stage, field, amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: dict(values) for stage, values in self._stages.items()}
+
+    def records(self, **labels):
+        return [dict(labels, stage=stage, **values) for stage, values in self.snapshot().items()]
+
+    def to_prometheus(self, prefix="praise", **labels):
+        lines = []
+        snapshot = self.snapshot()
+        for field in FIELDS:
+            name = f"{prefix}_stage_{field}_total"
+            lines.append(f"# HELP {name} {FIELD_HELP[field]}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, values in snapshot.items():
+                label_text = ",".join(f'{key}="{value}"' for key, value in dict(labels, stage=stage).items())
+                lines.append(f"{name}{{{label_text}}} {values[field]}")
+        return "\n".join(lines) + "\n"
+
+
+def record_call_event(field, amount=1):
+    call = getattr(_local, "call", None)
+    if call is not None:
+        metrics, stage = call
+        metrics.add(stage, field, amount)
+
+
+# rough token count of a list of prompt parts or of a single text, about four characters per token
+# for english text. Budgets the prompts, reserves rate limit quota and stands in for missing usage
+def estimate_tokens(parts):
+    if not isinstance(parts, (list, tuple)):
+        parts = [parts]
+    return sum(len(str(part)) for part in parts) // 4 + 1
+
+
+def usage_count(response, field):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, field, None) if usage is not None else None
+
+
+# wraps the model of a stage and records every call it makes: time, tokens and errors, plus the
+# retries and cache hits reported from the layers below through record_call_event. Token counts
+# come from the response usage metadata and are estimated for cached or replayed responses
+class InstrumentedModel:
+    def __init__(self, model, metrics, stage):
+        self.model = model
+        self.metrics = metrics
+        self.stage = stage
+
+    def generate_content(self, prompt_parts, **kwargs):
+        previous = getattr(_local, "call", None)
+        _local.call = (self.metrics, self.stage)
+        start = time.perf_counter()
+        try:
+            response = self.model.generate_content(prompt_parts, **kwargs)
+        except Exception:
+            self.metrics.add(self.stage, "errors")
+            self.metrics.add(self.stage, "call_seconds", time.perf_counter() - start)
+            raise
+        finally:
+            _local.call = previous
+        self.metrics.add(self.stage, "calls")
+
+        if kwargs.get("stream"):
+            return self._measure_stream(prompt_parts, response, start)
+        try:
+            text = response.text
+        except Exception:
+            text = ""
+        self.record_usage(prompt_parts, response, text, start)
+        return response
+
+    def _measure_stream(self, prompt_parts, response, start):
+        chunks = []
+        last = None
+        for chunk in response:
+            chunks.append(chunk.text)
+            last = chunk
+            yield chunk
+        # the usage metadata of a stream arrives with its last chunk
+        self.record_usage(prompt_parts, last, "".join(chunks), start)
+
+    def record_usage(self, prompt_parts, response, text, start):
+        prompt_tokens = usage_count(response, "prompt_token_count")
+        output_tokens = usage_count(response, "candidates_token_count")
+        self.metrics.add(self.stage, "prompt_tokens",
+                         prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt_parts))
+        self.metrics.add(self.stage, "output_tokens",
+                         output_tokens if output_tokens is not None else estimate_tokens([text]))
+        self.metrics.add(self.stage, "call_seconds", time.perf_counter() - start)
+
+
+def instrument_models(models, metrics):
+    return {stage: InstrumentedModel(model, metrics, stage) for stage, model in models.items()}
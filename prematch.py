@@ -0,0 +1,110 @@
+import difflib
+import re
+
+from canonicalize import stem
+
+
+STOP_WORDS = {"a", "an", "the", "and", "or", "of", "in", "on", "for", "with", "to", "is", "it", "its", "are",
+              "be", "by", "as", "at", "this", "that", "yes", "no", "not", "very", "can", "has", "have", "allowed"}
+NEGATIONS = {"no", "not", "without", "non", "never", "nor"}
+# values phrased like this are judgements, the model decides whether they are opinions
+OPINION_WORDS = {"good", "great", "bad", "best", "worst", "nice", "excellent", "poor", "amazing", "awesome",
+                 "terrible", "better", "worse", "love", "like", "hate", "perfect", "decent", "cheap", "beautiful",
+                 "comfortable", "easy", "hard", "soft", "loud", "quiet", "fast", "slow", "bright", "durable"}
+
+UNIT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*-?\s*([a-z\"']+)?")
+# sentences end at punctuation or at a line break, clauses at commas, semicolons and brackets
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?;])\s+|\s*\n\s*")
+CLAUSE_PATTERN = re.compile(r"[,;()]")
+
+
+def tokenize(text):
+    text = str(text).lower()
+    # "512 GB" and "13-inch" are indexed as single tokens "512gb" and "13inch"
+    text = UNIT_PATTERN.sub(lambda match: match.group(1) + (match.group(2) or ""), text)
+    tokens = [token.strip(".\"'") for token in re.findall(r"[a-z0-9.\"']+", text)]
+    return [stem(token) for token in tokens if token]
+
+
+def meaningful_tokens(tokens):
+    return [token for token in tokens if token not in STOP_WORDS and (len(token) > 2 or token[:1].isdigit())]
+
+
+# one line of text with single spaces and no pipes, safe to put in a table cell
+def table_cell(text):
+    return " ".join(str(text).split()).replace("|", "/")
+
+
+# fuzzy so that "color" is not reported missing from a description that says "colour"
+def mentioned(token, tokens, cutoff=0.8):
+    return token in tokens or bool(difflib.get_close_matches(token, tokens, n=1, cutoff=cutoff))
+
+
+# index of the seller description built once per comparison: its tokens, its n-grams, and
+# for each n-gram the sentence it comes from, quoted as evidence, and the tokens of its clause
+class DescriptionIndex:
+    def __init__(self, description, max_ngram=4):
+        self.max_ngram = max_ngram
+        self.tokens = set()
+        self.ngrams = {}
+        for sentence in SENTENCE_PATTERN.split(str(description)):
+            evidence = table_cell(sentence)
+            for clause in CLAUSE_PATTERN.split(sentence):
+                tokens = tokenize(clause)
+                self.tokens.update(tokens)
+                clause_tokens = frozenset(tokens)
+                for n in range(1, max_ngram + 1):
+                    for start in range(len(tokens) - n + 1):
+                        ngram = tuple(tokens[start:start + n])
+                        negated = any(token in NEGATIONS for token in tokens[max(0, start - 3):start])
+                        self.ngrams.setdefault(ngram, (evidence, negated, clause_tokens))
+
+    def find(self, tokens):
+        return self.ngrams.get(tuple(tokens)) if len(tokens) <= self.max_ngram else None
+
+    def mentions(self, token, cutoff=0.8):
+        return mentioned(token, self.tokens, cutoff)
+
+
+# returns the "Description" column for pairs that can be judged without the model, None otherwise
+def prematch_pair(index, attribute, value):
+    value_tokens = tokenize(value)
+    if not meaningful_tokens(value_tokens) or OPINION_WORDS.intersection(value_tokens):
+        return None
+
+    attribute_tokens = meaningful_tokens(tokenize(attribute))
+    found = index.find(value_tokens)
+    if found is not None:
+        evidence, negated, clause_tokens = found
+        if negated or any(token in NEGATIONS for token in value_tokens):
+            return None
+        # the value alone is not enough, "ram: 512gb" does not match "16GB RAM, 512GB SSD storage"
+        attribute_tokens = [token for token in attribute_tokens if token not in value_tokens]
+        if not attribute_tokens or not all(mentioned(token, clause_tokens) for token in attribute_tokens):
+            return None
+        return f"matches >> {evidence}"
+
+    tokens = attribute_tokens + meaningful_tokens(value_tokens)
+    if not any(index.mentions(token) for token in tokens):
+        return "missing"
+    return None
+
+
+# splits every review's attribute-value pairs into the rows decided locally and the
+# ambiguous pairs that still need the model, both lists are aligned with the reviews
+def prematch_reviews(seller_description, reviews):
+    index = DescriptionIndex(seller_description)
+    ambiguous_reviews = []
+    prematched_rows = []
+    for review in reviews:
+        ambiguous = {}
+        rows = []
+        for attribute, value in review.items():
+            description = prematch_pair(index, attribute, value)
+            if description is None:
+                ambiguous[attribute] = value
+            else:
+                rows.append([table_cell(attribute), table_cell(value), table_cell(description)])
+        ambiguous_reviews.append(ambiguous)
+        prematched_rows.append(rows)
+    return ambiguous_reviews, prematched_rows
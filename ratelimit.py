@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+
+from metrics import record_call_event, estimate_tokens
+
+
+RETRYABLE_STATUS_CODES = {429, 500, 503, 504}
+RETRYABLE_MESSAGES = ["internal error", "resource exhausted", "too many requests", "rate limit",
+                      "quota", "unavailable", "deadline", "timed out"]
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+# classic token bucket, refilled continuously at rate_per_minute up to capacity
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # returns the amount taken, a request larger than the bucket would wait forever, so it
+    # only waits for and takes a full bucket
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return amount
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # gives back the part of a reservation that was not used
+    def release(self, amount):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=60, tokens_per_minute=1000000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens):
+        self.requests.acquire(1)
+        return self.tokens.acquire(tokens)
+
+    def release(self, tokens):
+        self.tokens.release(tokens)
+
+
+# stops sending requests for reset_timeout seconds after failure_threshold
+# consecutive failures, then lets a single trial request through
+class CircuitBreaker:
+    def __init__(self, failure_threshold=8, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    # waits while the circuit is open instead of failing the call. Once the pause is over one
+    # caller becomes the trial call and the others wait for its outcome. A trial that never
+    # reports back within reset_timeout is replaced. Only a circuit that opened again while
+    # waiting, the trial failed, raises CircuitOpenError, so a caller waits one pause at a time
+    def before_call(self):
+        with self._lock:
+            opened_at = self.opened_at
+            while self.opened_at is not None:
+                if self.opened_at != opened_at:
+                    raise CircuitOpenError(
+                        f"Model calls paused for {self.reset_timeout:.0f}s after {self.failures} consecutive failures")
+                now = time.monotonic()
+                if now < self.opened_at + self.reset_timeout:
+                    self._changed.wait(self.opened_at + self.reset_timeout - now)
+                elif self.probe_started_at is None or now - self.probe_started_at >= self.reset_timeout:
+                    self.probe_started_at = now
+                    return
+                else:
+                    self._changed.wait(self.probe_started_at + self.reset_timeout - now)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+            self._changed.notify_all()
+
+    # count=False reports a failure that does not count towards failure_threshold, it still ends
+    # a trial call
+    def record_failure(self, count=True):
+        with self._lock:
+            if count:
+                self.failures += 1
+            # a failed trial call opens the circuit again straight away
+            if self.failures >= self.failure_threshold or self.probe_started_at is not None:
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+                self._changed.notify_all()
+
+
+def is_retryable(error):
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    message = str(error).lower()
+    return any(text in message for text in RETRYABLE_MESSAGES)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+# wrapper around a model that throttles generate_content calls to the client
+# side quota and retries transient errors with backoff. Each call reserves its prompt
+# tokens plus max_output_tokens of the token quota, and gives back what the response
+# usage shows it did not use
+class ResilientModel:
+    def __init__(self, model, limiter=None, breaker=None, max_attempts=6, base_delay=1.0, max_delay=60.0,
+                 max_output_tokens=0):
+        self.model = model
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_output_tokens = max_output_tokens or 0
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt_parts, **kwargs):
+        # cache is an option of CachedModel, a model without a cache always answers afresh
+        kwargs.pop("cache", None)
+        tokens = estimate_tokens(prompt_parts) + self.max_output_tokens
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                try:
+                    self.breaker.before_call()
+                except CircuitOpenError:
+                    # the pause was already waited out, it counts as an attempt
+                    if attempt == self.max_attempts - 1:
+                        raise
+                    continue
+            if self.limiter is not None:
+                reserved = self.limiter.acquire(tokens)
+            try:
+                response = self.model.generate_content(prompt_parts, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # the service answered, so a trial call of the breaker is over
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    raise e
+                # a failed first attempt is a blip the backoff handles, only calls that keep failing
+                # count towards opening the circuit. Otherwise one round of concurrent first
+                # attempts failing together would open it
+                if self.breaker is not None:
+                    self.breaker.record_failure(count=attempt > 0)
+                if attempt == self.max_attempts - 1:
+                    raise e
+                with self._lock:
+                    self.retries += 1
+                record_call_event("retries")
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+            if self.breaker is not None:
+                self.breaker.record_success()
+            # the usage of a stream is only known once it is consumed, it keeps its whole reservation
+            if self.limiter is not None and not kwargs.get("stream"):
+                used = getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+                if isinstance(used, int) and used < reserved:
+                    self.limiter.release(reserved - used)
+            return response
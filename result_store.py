@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+DEFAULT_STORE_PATH = os.path.join('.praise_cache', 'results.sqlite')
+
+
+def review_hash(review):
+    return hashlib.sha256(str(review).encode('utf-8')).hexdigest()
+
+
+# the comparison of a review only depends on its details and the seller description, so
+# reviews with the same details share one stored table
+def details_hash(details):
+    return hashlib.sha256(json.dumps(details, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def description_hash(description):
+    return hashlib.sha256(str(description).strip().encode('utf-8')).hexdigest()
+
+
+# everything besides the input that a stored result depends on: the stage model, its generation
+# config, the version of the stage prompt and the stage options, as in ResponseCache.make_key.
+# model_config is the {model, temperature, max_tokens} of the stage
+def config_key(model_config, prompt_version, **options):
+    payload = json.dumps({
+        "model": model_config.get("model"),
+        "temperature": model_config.get("temperature"),
+        "max_output_tokens": model_config.get("max_tokens"),
+        "prompt_version": prompt_version,
+        "options": options,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# per product store of the extraction of every review and of the comparison of every set of
+# details with the current seller description, so a new run only pays for the reviews it has
+# not seen before. A new description only invalidates the comparisons, and results are only
+# reused under the config_key they were produced with
+class ResultStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # results stored before the config was part of the key can't be told apart, they are dropped
+        for table in ("extractions", "comparisons"):
+            columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            if columns and "config" not in columns:
+                self._conn.execute(f"DROP TABLE {table}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions (product_id TEXT NOT NULL, config TEXT NOT NULL, review_hash TEXT NOT NULL, details TEXT NOT NULL, PRIMARY KEY (product_id, config, review_hash))")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS comparisons (product_id TEXT NOT NULL, config TEXT NOT NULL, description_hash TEXT NOT NULL, details_hash TEXT NOT NULL, review_table TEXT NOT NULL, PRIMARY KEY (product_id, config, description_hash, details_hash))")
+        self._conn.commit()
+
+    def get_extractions(self, product_id, config):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT review_hash, details FROM extractions WHERE product_id = ? AND config = ?",
+                (product_id, config)).fetchall()
+        return {key: json.loads(details) for key, details in rows}
+
+    def put_extractions(self, product_id, config, extractions):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?)",
+                                   [(product_id, config, key, json.dumps(details)) for key, details in extractions.items()])
+            self._conn.commit()
+
+    def get_comparisons(self, product_id, description, config):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT details_hash, review_table FROM comparisons WHERE product_id = ? AND config = ? AND description_hash = ?",
+                (product_id, config, description_hash(description))).fetchall()
+        return dict(rows)
+
+    # tables compared against an older description are dropped as soon as new ones are stored
+    def put_comparisons(self, product_id, description, config, review_tables):
+        key = description_hash(description)
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM comparisons WHERE product_id = ? AND config = ? AND description_hash != ?",
+                (product_id, config, key))
+            self._conn.executemany("INSERT OR REPLACE INTO comparisons VALUES (?, ?, ?, ?, ?)",
+                                   [(product_id, config, key, details_key, table) for details_key, table in review_tables.items()])
+            self._conn.commit()
+
+    def stats(self, product_id):
+        with self._lock:
+            extractions = self._conn.execute(
+                "SELECT COUNT(*) FROM extractions WHERE product_id = ?", (product_id,)).fetchone()[0]
+            comparisons = self._conn.execute(
+                "SELECT COUNT(*) FROM comparisons WHERE product_id = ?", (product_id,)).fetchone()[0]
+        return {"extractions": extractions, "comparisons": comparisons}
@@ -0,0 +1,193 @@
+import hashlib
+import io
+import json
+import re
+
+
+# a malformed array element is skipped up to the next comma or ] outside of strings and brackets
+STRUCTURE_PATTERN = re.compile(r'["\[\]{},]')
+STRING_REST_PATTERN = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+SEPARATOR_PATTERN = re.compile(r"[\s,]*")
+
+
+def open_text(source):
+    if isinstance(source, str):
+        return io.StringIO(source)
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    if isinstance(source.read(0), bytes):
+        return io.TextIOWrapper(source, encoding="utf-8", errors="replace")
+    return source
+
+
+# digest of the raw input, read in chunks so large uploads are never copied
+def source_digest(source, chunk_size=1 << 20):
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    source.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        digest.update(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def review_text(entry):
+    if isinstance(entry, str):
+        return entry
+    if not isinstance(entry, dict):
+        raise ValueError(f"expected an object with a 'review' key, got {type(entry).__name__}")
+    if "review" not in entry:
+        raise ValueError("the entry has no 'review' key")
+    if not isinstance(entry["review"], str):
+        raise ValueError("the 'review' value is not a string")
+    return entry["review"]
+
+
+# yields the review texts of a JSON array or of a JSONL file one at a time, reading the input in
+# chunks so memory does not grow with the file size. Entries that can't be read are appended to
+# errors as {"Entry", "Error"} and skipped
+def iter_reviews(source, errors=None, chunk_size=1 << 16):
+    if errors is None:
+        errors = []
+    f = open_text(source)
+    try:
+        buffer = ""
+        while not buffer.strip():
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+
+        if buffer.lstrip().startswith("["):
+            entries = iter_json_array(f, buffer, errors, chunk_size)
+        else:
+            entries = iter_json_lines(f, buffer, errors)
+
+        for number, entry in entries:
+            try:
+                yield review_text(entry)
+            except ValueError as e:
+                errors.append({"Entry": number, "Error": str(e)})
+    finally:
+        # closing the text wrapper would close the caller's file, which is read again on reruns
+        if f is not source and isinstance(f, io.TextIOWrapper):
+            f.detach()
+
+
+def iter_json_lines(f, buffer, errors):
+    lines = io.StringIO(buffer)
+    number = 0
+    for line in lines_of(lines, f):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append({"Entry": number, "Error": f"invalid JSON: {e}"})
+
+
+def lines_of(head, f):
+    # the first chunk was already read to detect the format, its last line continues in f
+    pending = ""
+    for line in head:
+        if not line.endswith("\n"):
+            pending = line
+            break
+        yield line
+    line = pending + f.readline()
+    if line:
+        yield line
+    yield from f
+
+
+# finds the end of the array entry that starts at position, the index of the comma after it or of
+# the closing ] of the array. Returns (None, position, depth) to go on from when the buffer ends
+# first, position is kept at the start of a string that is cut off
+def scan_entry(buffer, position, depth=0):
+    while True:
+        match = STRUCTURE_PATTERN.search(buffer, position)
+        if match is None:
+            return None, len(buffer), depth
+        char = match.group()
+        if char == '"':
+            string = STRING_REST_PATTERN.match(buffer, match.end())
+            if string is None:
+                return None, match.start(), depth
+            position = string.end()
+            continue
+        if char in "[{":
+            depth += 1
+        elif depth > 0:
+            if char != ",":
+                depth -= 1
+        elif char != "}":
+            return match.start(), match.start(), depth
+        # a stray } is part of the malformed entry
+        position = match.end()
+
+
+def iter_json_array(f, buffer, errors, chunk_size):
+    decoder = json.JSONDecoder()
+    position = buffer.index("[") + 1
+    number = 0
+    at_end = False
+
+    while True:
+        # drop what was already decoded so the buffer only holds the entry being read
+        if position > chunk_size:
+            buffer = buffer[position:]
+            position = 0
+
+        position = SEPARATOR_PATTERN.match(buffer, position).end()
+        if position >= len(buffer):
+            if at_end:
+                errors.append({"Entry": number + 1, "Error": "the input ends before the closing ] of the array"})
+                return
+            chunk = f.read(chunk_size)
+            at_end = not chunk
+            buffer += chunk
+            continue
+        if buffer[position] == "]":
+            return
+
+        try:
+            entry, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            # an entry cut off at the end of the buffer is read further, anything else is malformed
+            truncated = e.msg.startswith("Unterminated string") or e.pos >= len(buffer) - 5
+            if truncated and not at_end:
+                chunk = f.read(chunk_size)
+                at_end = not chunk
+                buffer += chunk
+                continue
+            number += 1
+            errors.append({"Entry": number, "Error": f"invalid JSON: {e.msg}"})
+            end, position, depth = scan_entry(buffer, position)
+            while end is None and not at_end:
+                buffer = buffer[position:]
+                chunk = f.read(chunk_size)
+                at_end = not chunk
+                buffer += chunk
+                end, position, depth = scan_entry(buffer, 0, depth)
+            if end is None:
+                return
+            # the separator or the closing ] is handled like after a valid entry
+            position = end
+            continue
+
+        # a number that ends with the buffer may go on in the next chunk
+        if end == len(buffer) and not at_end:
+            chunk = f.read(chunk_size)
+            at_end = not chunk
+            buffer += chunk
+            continue
+
+        number += 1
+        position = end
+        yield number, entry
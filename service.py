@@ -0,0 +1,179 @@
+import argparse
+import json
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch import add_pipeline_arguments, check_pipeline_arguments, build_pipeline, process_product, Checkpoints
+from job_queue import JobQueue, DEFAULT_QUEUE_PATH, QUEUED, DONE
+from metrics import Metrics
+
+
+# the product record process_product expects, built from a submitted job
+def job_payload(body):
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object with description and reviews")
+    if not isinstance(body.get("reviews"), list):
+        raise ValueError("reviews must be a list of strings or of objects with a 'review' key")
+    payload = {"description": str(body.get("description") or ""), "reviews": body["reviews"],
+               "vertical": str(body.get("vertical") or "")}
+    if body.get("product_id"):
+        payload["product_id"] = str(body["product_id"])
+    return payload
+
+
+def run_job(queue, job_id, payload, pipeline, args):
+    models, category_index, synonyms, store = pipeline
+    # results of jobs without a product id can't be matched with later jobs, so they skip the store,
+    # and their checkpoints, only needed if the worker dies mid job, are removed once it finished
+    anonymous = "product_id" not in payload
+    product = dict(payload, product_id=payload.get("product_id") or job_id)
+    metrics = Metrics()
+    try:
+        result = process_product(product, models, args, category_index, synonyms, metrics,
+                                 None if anonymous else store)
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}", file=sys.stderr)
+        queue.fail(job_id, e)
+        return
+    finally:
+        if anonymous:
+            Checkpoints(args.checkpoint_dir, job_id).remove()
+    result["metrics"] = metrics.records()
+    queue.complete(job_id, result)
+
+
+def worker_main(args, worker):
+    # the api quota is shared by the whole pool, each worker gets an equal part of it
+    worker_args = argparse.Namespace(**dict(
+        vars(args), requests_per_minute=max(1, args.requests_per_minute // args.workers),
+        tokens_per_minute=max(1, args.tokens_per_minute // args.workers)))
+    pipeline = build_pipeline(worker_args)
+    queue = JobQueue(args.queue_path, args.max_attempts)
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(args.poll_interval)
+            continue
+        run_job(queue, *job, pipeline, worker_args)
+
+
+# POST /jobs submits a {description, reviews, vertical, product_id} job, GET /jobs/<id> returns its
+# status, GET /jobs/<id>/result its result once done, and GET /health the job counts
+class ServiceHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": f"no such endpoint {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = job_payload(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        job_id = self.server.queue.submit(payload)
+        self.send_json(202, {"job_id": job_id, "status": QUEUED})
+
+    def do_GET(self):
+        queue = self.server.queue
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["health"]:
+            self.send_json(200, {"workers": self.server.worker_count, "jobs": queue.counts()})
+            return
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or (len(parts) == 3 and parts[2] != "result"):
+            self.send_json(404, {"error": f"no such endpoint {self.path}"})
+            return
+
+        status = queue.status(parts[1])
+        if status is None:
+            self.send_json(404, {"error": f"no job {parts[1]}"})
+        elif len(parts) == 2:
+            self.send_json(200, status)
+        elif status["status"] != DONE:
+            self.send_json(409, status)
+        else:
+            self.send_json(200, queue.result(parts[1]))
+
+
+# workers are separate processes so the pipelines of different jobs don't share the GIL. They are
+# spawned rather than forked, the gRPC client of the model library is not fork safe
+def start_worker(context, args, worker):
+    process = context.Process(target=worker_main, args=(args, worker), name=worker, daemon=True)
+    process.start()
+    return process
+
+
+def serve(args):
+    queue = JobQueue(args.queue_path, args.max_attempts)
+    # jobs that were running when the service last stopped are picked up again
+    requeued = queue.requeue()
+    if requeued:
+        print(f"Requeued {requeued} jobs left running by the last run", file=sys.stderr)
+
+    context = multiprocessing.get_context("spawn")
+    workers = {f"worker-{number}": None for number in range(args.workers)}
+    for worker in workers:
+        workers[worker] = start_worker(context, args, worker)
+
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    server.queue = queue
+    server.worker_count = args.workers
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving on http://{args.host}:{server.server_port} with {args.workers} workers", file=sys.stderr)
+    # a service manager stops the service with SIGTERM, which shuts down like Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        # a worker that died, for instance out of memory, is replaced and its job queued again
+        while True:
+            time.sleep(1)
+            for worker, process in workers.items():
+                if not process.is_alive():
+                    print(f"{worker} exited with code {process.exitcode}, restarting it", file=sys.stderr)
+                    queue.requeue(worker)
+                    workers[worker] = start_worker(context, args, worker)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join()
+        # the jobs were stopped on purpose, that doesn't count as a failed attempt
+        queue.requeue(count_attempt=False)
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the PRAISE pipeline over HTTP, jobs are queued in SQLite and run by a pool of worker processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=2,
+                        help="number of worker processes, each runs one job at a time")
+    parser.add_argument("--queue-path", default=DEFAULT_QUEUE_PATH,
+                        help="SQLite file holding the job queue and the results")
+    parser.add_argument("--poll-interval", type=float, default=1.0,
+                        help="seconds an idle worker waits before looking for a new job")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="times a job is started before a job that keeps stopping its worker is failed")
+    add_pipeline_arguments(parser)
+    args = parser.parse_args(argv)
+    check_pipeline_arguments(parser, args)
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(serve(parse_args()))
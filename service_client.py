@@ -0,0 +1,44 @@
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class ServiceError(RuntimeError):
+    pass
+
+
+def request_json(url, body=None, timeout=30):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    request = urllib.request.Request(url, data=data, method="GET" if body is None else "POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error") or e.reason
+        except (ValueError, AttributeError):
+            message = e.reason
+        raise ServiceError(f"{e.code}: {message}") from e
+    except (urllib.error.URLError, OSError) as e:
+        raise ServiceError(f"could not reach {url}: {e}") from e
+
+
+def job_url(service_url, *parts):
+    return "/".join([service_url.rstrip("/"), "jobs"] + [urllib.parse.quote(part) for part in parts])
+
+
+def submit_job(service_url, description, reviews, vertical="", product_id=""):
+    body = {"description": description, "reviews": reviews, "vertical": vertical}
+    if product_id:
+        body["product_id"] = product_id
+    return request_json(job_url(service_url), body)["job_id"]
+
+
+def job_status(service_url, job_id):
+    return request_json(job_url(service_url, job_id))
+
+
+def job_result(service_url, job_id):
+    return request_json(job_url(service_url, job_id, "result"))
@@ -0,0 +1,83 @@
+import os
+import warnings
+
+import pytest
+
+from result_store import ResultStore, config_key, review_hash
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import batch
+    from benchmark import MockModel, synthetic_product
+
+
+class Crash(Exception):
+    pass
+
+
+# stops the run right after the extractions are stored, before the extract checkpoint is written
+class CrashingStore(ResultStore):
+    def put_extractions(self, product_id, config, extractions):
+        super().put_extractions(product_id, config, extractions)
+        raise Crash()
+
+
+def parse_args(tmp_path, checkpoints="checkpoints", *options):
+    return batch.parse_args([os.path.join(tmp_path, "input.jsonl"), "--checkpoint-dir", os.path.join(tmp_path, checkpoints),
+                             "--api-key", "unused", "--concurrency", "1", "--no-cache", *options])
+
+
+@pytest.fixture
+def args(tmp_path):
+    return parse_args(tmp_path)
+
+
+def run(product, args, store, model=None):
+    model = model or MockModel(median=0.0)
+    result = batch.process_product(product, {"extract": model, "compare": model, "group": model}, args, store=store)
+    return result, model
+
+
+def test_store_keys_results_on_their_config(tmp_path):
+    store = ResultStore(os.path.join(tmp_path, "results.sqlite"))
+    first = config_key({"model": "a"}, 1, batched=True)
+    second = config_key({"model": "a"}, 1, batched=False)
+    assert first != second
+    store.put_extractions("p", first, {review_hash("red shirt"): {"color": "red"}})
+    assert store.get_extractions("p", first) == {review_hash("red shirt"): {"color": "red"}}
+    assert store.get_extractions("p", second) == {}
+
+
+def test_a_new_description_drops_the_old_comparisons(tmp_path):
+    store = ResultStore(os.path.join(tmp_path, "results.sqlite"))
+    store.put_comparisons("p", "old", "config", {"details": "table"})
+    assert store.get_comparisons("p", "old", "config") == {"details": "table"}
+    store.put_comparisons("p", "new", "config", {"details": "new table"})
+    assert store.get_comparisons("p", "old", "config") == {}
+    assert store.get_comparisons("p", "new", "config") == {"details": "new table"}
+
+
+def test_a_rerun_only_extracts_new_reviews(tmp_path, args):
+    store = ResultStore(os.path.join(tmp_path, "results.sqlite"))
+    product = synthetic_product(20, seed=3)
+    first, _ = run(product, args, store)
+    product["reviews"].append({"review": "The color is teal. Love it."})
+    second, model = run(product, args, store)
+    assert second["descriptive_details"][:20] == first["descriptive_details"]
+    assert second["descriptive_details"][20] == {"color": "teal"}
+    # one extraction for the new review, the comparisons of the unchanged details are reused
+    assert model.calls <= 3
+
+
+# the dedup checkpoint used to hold positions in the list of unseen reviews, which is empty
+# on resume once the extractions are stored
+def test_resume_after_a_crash_between_storing_and_checkpointing(tmp_path, args):
+    product = synthetic_product(30, seed=1)
+    path = os.path.join(tmp_path, "results.sqlite")
+    with pytest.raises(Crash):
+        run(product, args, CrashingStore(path))
+    resumed, _ = run(product, args, ResultStore(path))
+
+    expected, _ = run(product, parse_args(tmp_path, "fresh", "--no-store"), None)
+    assert resumed["descriptive_details"] == expected["descriptive_details"]
+    assert resumed["review_tables"] == expected["review_tables"]
@@ -0,0 +1,46 @@
+import json
+import os
+
+from canonicalize import (SynonymTable, attribute_signature, build_canonical_mapping, canonicalize_descriptive_details,
+                          spelling_variants)
+
+
+def test_signatures_ignore_case_plurals_and_modifiers():
+    assert attribute_signature("Colors") == attribute_signature("color")
+    assert attribute_signature("colour options") == "colour"
+    assert attribute_signature("Batteries") == "battery"
+    assert attribute_signature("glass") == "glass"
+
+
+def test_only_spellings_of_the_same_words_are_variants():
+    assert spelling_variants("colour", "color")
+    assert not spelling_variants("wrist size", "waist size")
+    assert not spelling_variants("usb 2", "usb 3")
+    assert not spelling_variants("size", "shoe size")
+
+
+def test_the_most_frequent_spelling_becomes_canonical():
+    mapping = build_canonical_mapping(["color", "Colors", "color", "colour", "material"])
+    assert {attribute: canonical for attribute, (canonical, _) in mapping.items()} == {
+        "color": "color", "Colors": "color", "colour": "color", "material": "material"}
+    assert mapping["colour"][1].startswith("fuzzy match")
+
+
+def test_merged_keys_of_one_review_keep_all_their_values():
+    details, audit = canonicalize_descriptive_details([{"color": "red", "Colors": "blue"}, {"color": "green"}])
+    assert details == [{"color": "red, blue"}, {"color": "green"}]
+    assert audit == [{"Attribute": "Colors", "Canonical attribute": "color", "Reason": "normalized"}]
+
+
+def test_normalized_merges_are_learned_and_fuzzy_ones_are_not(tmp_path):
+    path = os.path.join(tmp_path, "synonyms.json")
+    canonicalize_descriptive_details([{"Color": "red"}, {"Color": "red"}, {"colors": "blue"}, {"colour": "green"}],
+                                     SynonymTable(path))
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"color": "Color"}
+
+    # a learned entry applies to later runs where the canonical spelling is the rarer one
+    details, audit = canonicalize_descriptive_details([{"color": "red"}, {"color": "blue"}, {"Color": "green"}],
+                                                      SynonymTable(path))
+    assert details == [{"Color": "red"}, {"Color": "blue"}, {"Color": "green"}]
+    assert audit[0]["Reason"] == "synonym table"
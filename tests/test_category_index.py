@@ -0,0 +1,58 @@
+import os
+import warnings
+
+import pytest
+
+from category_index import CategoryIndex
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import demo
+
+
+@pytest.fixture
+def path(tmp_path):
+    return os.path.join(tmp_path, "index.json")
+
+
+def test_known_attributes_are_grouped_locally(path):
+    index = CategoryIndex(path)
+    index.update("apparel", {"Colors": ["Color", "shade"], "Fabric": "material"})
+    assert index.categories("apparel") == ["Colors", "Fabric"]
+    assert index.categories("electronics") == []
+    assert index.lookup("apparel", ["color", "size", "size", "material"]) == ["size"]
+    assert index.group("apparel", ["color", "Material", "size"]) == {"Colors": ["color"], "Fabric": ["Material"]}
+
+
+def test_an_attribute_can_belong_to_several_categories(path):
+    index = CategoryIndex(path)
+    index.update("apparel", {"Colors": ["color"]})
+    index.update("apparel", {"Appearance": ["color"]})
+    assert index.group("apparel", ["color"]) == {"Colors": ["color"], "Appearance": ["color"]}
+
+
+def test_assignments_are_shared_through_the_file(path):
+    first, second = CategoryIndex(path), CategoryIndex(path)
+    first.update("apparel", {"Colors": ["color"]})
+    second.update("apparel", {"Fit": ["size"]})
+    assert first.lookup("apparel", ["color", "size"]) == []
+    assert CategoryIndex(path).categories("apparel") == ["Colors", "Fit"]
+
+
+def test_an_unchanged_index_is_not_written_again(path):
+    index = CategoryIndex(path)
+    index.update("apparel", {"Colors": ["color"]})
+    modified = os.stat(path).st_mtime_ns
+    index.update("apparel", {"Colors": ["Color"]})
+    assert os.stat(path).st_mtime_ns == modified
+
+
+def test_grouping_with_the_index_only_adds_back_the_known_attributes(path):
+    index = CategoryIndex(path)
+    index.update("apparel", {"Colors": ["color"]})
+    response = 'DICTIONARY\n{"Fit": ["size"]}\nEXPLANATION\nSizes.'
+    dictionary, _, errored = demo.extract_grouped_attributes(response, "apparel", ["color", "size"], index)
+    assert not errored
+    assert dictionary == {"Colors": ["color"], "Fit": ["size"]}
+    # nothing left for the model
+    assert demo.extract_grouped_attributes("", "apparel", ["color", "size"], index)[0] == dictionary
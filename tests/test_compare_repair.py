@@ -0,0 +1,73 @@
+import os
+import warnings
+
+from llm_cache import CachedModel, CachedResponse, ResponseCache
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import demo
+
+
+GOOD_TABLE = "Output table for Review 1\nAttribute | Value | Description\ncolor | red | matches >> color: red"
+MALFORMED_TABLE = "Output table for Review 1\nAttribute | Value | Description\ncolor red"
+
+
+# answers with the given replies in turn, then keeps repeating the last one
+class ScriptedModel:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def generate_content(self, prompt_parts, **kwargs):
+        reply = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        return CachedResponse(reply)
+
+
+def cached(model, tmp_path):
+    return CachedModel(model, ResponseCache(os.path.join(tmp_path, "responses.sqlite")), "test", {})
+
+
+# the repair of a single review sends the same prompt as the first call, the cache used to return
+# the malformed reply to it
+def test_the_repair_of_a_whole_shard_skips_the_cache(tmp_path):
+    model = ScriptedModel([MALFORMED_TABLE, GOOD_TABLE])
+    tables = demo.run_compare("The shirt is red.", [{"color": "red"}], model=cached(model, tmp_path),
+                              max_output_tokens=4000, repair_attempts=2)
+    assert model.calls == 2
+    assert demo.find_malformed_reviews(tables, 1) == []
+
+
+def test_a_malformed_reply_is_not_kept_for_reruns(tmp_path):
+    model = ScriptedModel([MALFORMED_TABLE, GOOD_TABLE, GOOD_TABLE])
+    cached_model = cached(model, tmp_path)
+    demo.run_compare("The shirt is red.", [{"color": "red"}], model=cached_model, max_output_tokens=4000,
+                     repair_attempts=0)
+    tables = demo.run_compare("The shirt is red.", [{"color": "red"}], model=cached_model, max_output_tokens=4000,
+                              repair_attempts=0)
+    assert model.calls == 2
+    assert demo.find_malformed_reviews(tables, 1) == []
+    # the good reply is kept
+    demo.run_compare("The shirt is red.", [{"color": "red"}], model=cached_model, max_output_tokens=4000,
+                     repair_attempts=0)
+    assert model.calls == 2
+
+
+def test_only_malformed_reviews_are_compared_again(tmp_path):
+    first = GOOD_TABLE + "\n\n" + MALFORMED_TABLE.replace("Review 1", "Review 2")
+    model = ScriptedModel([first, GOOD_TABLE])
+    tables = demo.run_compare("The shirt is red.", [{"color": "red"}, {"color": "blue"}],
+                              model=cached(model, tmp_path), max_output_tokens=4000, repair_attempts=2)
+    assert model.calls == 2
+    assert sorted(demo.split_review_tables(tables)) == [1, 2]
+    assert demo.find_malformed_reviews(tables, 2) == []
+
+
+def test_unreadable_grouping_replies_are_not_kept(tmp_path):
+    model = ScriptedModel(["no dictionary here", 'DICTIONARY\n{"Colors": ["color"]}\nEXPLANATION\nColors.'])
+    cached_model = cached(model, tmp_path)
+    table = demo.pd.DataFrame({"Attribute": ["color"]})
+    assert demo.group_attributes(table, model=cached_model) == "no dictionary here"
+    reply = demo.group_attributes(table, model=cached_model)
+    assert demo.extract_grouped_attributes(reply)[0] == {"Colors": ["color"]}
+    assert model.calls == 2
@@ -0,0 +1,45 @@
+import warnings
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import demo
+    from benchmark import MockModel
+
+
+DESCRIPTION = "The color is red. The material is cotton."
+REVIEWS = [{"color": "red"}, {"material": "silk"}, {"color": "red", "size": "large"}, {"material": "cotton"},
+           {"fit": "loose"}]
+
+
+def test_shards_fit_the_output_budget():
+    shards = demo.plan_comparison_shards(REVIEWS, max_output_tokens=100)
+    assert [review for shard in shards for review in shard] == REVIEWS
+    assert len(shards) > 1
+    assert all(sum(demo.estimate_comparison_output_tokens(review) for review in shard) <= 75
+               for shard in shards if len(shard) > 1)
+    assert demo.plan_comparison_shards([], max_output_tokens=100) == [[]]
+
+
+def test_tables_are_renumbered_by_the_shard_offset():
+    tables = "Output table for Review 1\ncolor | red | matches\n\n**Output table for Review 2**\nfit | loose | missing"
+    assert demo.renumber_review_tables(tables, 0) == tables
+    renumbered = demo.renumber_review_tables(tables, 3)
+    assert sorted(demo.split_review_tables(renumbered)) == [4, 5]
+
+
+def test_sharded_comparison_matches_a_single_request():
+    whole = demo.compare_with_seller_description(DESCRIPTION, REVIEWS, model=MockModel(median=0.0),
+                                                 max_output_tokens=100000)
+    model = MockModel(median=0.0)
+    sharded = demo.compare_with_seller_description(DESCRIPTION, REVIEWS, model=model, concurrency=4,
+                                                   max_output_tokens=100)
+    assert model.calls > 1
+    assert demo.split_review_tables(sharded) == demo.split_review_tables(whole)
+
+
+def test_streamed_rows_carry_their_global_review_numbers():
+    rows = []
+    demo.compare_with_seller_description(DESCRIPTION, REVIEWS, model=MockModel(median=0.0), concurrency=4,
+                                         max_output_tokens=100, on_row=lambda number, row: rows.append((number, row[0])))
+    assert sorted(rows) == sorted((number, attribute) for number, review in enumerate(REVIEWS, start=1)
+                                  for attribute in review)
@@ -0,0 +1,53 @@
+import random
+
+from dedup import DuplicateIndex, find_duplicate_reviews, normalize_review
+
+
+WORDS = ["shirt", "cotton", "red", "blue", "large", "small", "fits", "well", "soft", "fabric", "washes", "easily",
+         "collar", "sleeves", "short", "long", "buttons", "pocket", "zipper", "stretchy", "thin", "thick", "warm"]
+
+
+def random_reviews(count, length=20, seed=0):
+    generator = random.Random(seed)
+    return [" ".join(generator.choice(WORDS) for _ in range(length)) for _ in range(count)]
+
+
+def test_exact_duplicates_after_normalization_share_a_cluster():
+    reviews = ["Red cotton shirt, fits well!", "red  COTTON shirt fits well", "Blue silk dress"]
+    representatives, assignments = find_duplicate_reviews(reviews, threshold=1.0)
+    assert representatives == [0, 2]
+    assert assignments == [0, 0, 1]
+    assert normalize_review(reviews[0]) == normalize_review(reviews[1])
+
+
+def test_near_duplicates_share_a_cluster():
+    base = "the shirt is made of soft red cotton with a crew neck short sleeves and one chest pocket it runs a size large"
+    reviews = [base, base + " overall", "a completely different review about a blue silk dress with long sleeves"]
+    representatives, assignments = find_duplicate_reviews(reviews, threshold=0.8)
+    assert representatives == [0, 2]
+    assert assignments == [0, 0, 1]
+
+
+# unrelated reviews used to get high estimated similarities and were merged into a few clusters
+def test_unrelated_reviews_stay_apart():
+    reviews = random_reviews(300)
+    representatives, assignments = find_duplicate_reviews(reviews, threshold=0.8)
+    assert len(representatives) == len(set(map(normalize_review, reviews)))
+    assert assignments == list(range(len(reviews)))
+
+
+def test_signature_similarity_tracks_jaccard_similarity():
+    index = DuplicateIndex(threshold=0.5, num_perm=256, bands=64)
+    first, second = random_reviews(2, length=60, seed=1)
+    index.add(0, first)
+    assert index.add(1, second) == 1
+    assert index.add(2, first) == 0
+
+
+def test_the_earliest_similar_cluster_wins():
+    base = "soft red cotton shirt with a crew neck short sleeves one chest pocket and a size large fit"
+    index = DuplicateIndex(threshold=0.7)
+    assert index.add(0, base) == 0
+    assert index.add(1, "a blue silk dress with long sleeves and a zipper") == 1
+    assert index.add(2, base + " indeed") == 0
+    assert index.representatives == [0, 1]
@@ -0,0 +1,81 @@
+import re
+import warnings
+
+from llm_cache import CachedResponse
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import demo
+
+
+# answers batched prompts with one section per review, leaving out the reviews in skip, and
+# single review prompts with the review's own words as pairs
+class ExtractionModel:
+    def __init__(self, skip=()):
+        self.skip = set(skip)
+        self.prompts = []
+
+    def generate_content(self, prompt_parts, **kwargs):
+        self.prompts.append(prompt_parts)
+        if "numbered from 1" in prompt_parts[-2]:
+            reviews = re.findall(r"^Review (\d+): (.*)$", prompt_parts[-3], flags=re.MULTILINE)
+            return CachedResponse("\n".join(f"### Review {number}\n{self.extract(review)}"
+                                            for number, review in reviews if review not in self.skip))
+        return CachedResponse(self.extract(prompt_parts[-2].rsplit("Review: ", 1)[1]))
+
+    def extract(self, review):
+        color, material = review.split()
+        return f"Opinions to be discarded: none\nExtracted descriptive pairs\ncolor: {color}\nmaterial: {material}"
+
+
+REVIEWS = ["red cotton", "blue silk", "green wool", "black linen"]
+
+
+def test_batched_replies_are_split_on_the_review_headers():
+    text = "### Review 1\ncolor: red\n**Review 2**\ncolor: blue\nReview 3:\ncolor: green"
+    assert demo.split_batched_extraction(text, 3) == {1: "\ncolor: red\n", 2: "\ncolor: blue\n", 3: "\ncolor: green"}
+
+
+def test_repeated_and_unknown_review_numbers_are_dropped():
+    text = "### Review 1\ncolor: red\n### Review 1\ncolor: blue\n### Review 2\ncolor: green\n### Review 9\ncolor: black"
+    assert list(demo.split_batched_extraction(text, 2)) == [2]
+
+
+def test_batches_fit_the_output_budget_and_the_batch_size():
+    reviews = ["word " * 40] * 10
+    batches = demo.plan_extraction_batches(reviews, max_output_tokens=400)
+    assert [i for batch in batches for i, _ in batch] == list(range(10))
+    assert all(sum(demo.estimate_extraction_output_tokens(review) for _, review in batch) <= 300
+               for batch in batches if len(batch) > 1)
+    assert [len(batch) for batch in demo.plan_extraction_batches(["short"] * 7, 100000, max_batch_size=3)] == [3, 3, 1]
+
+
+def test_batches_are_yielded_before_the_reviews_run_out():
+    read = []
+
+    def reviews():
+        for review in REVIEWS:
+            read.append(review)
+            yield review
+
+    batches = demo.iter_extraction_batches(reviews(), max_output_tokens=100000, max_batch_size=2)
+    next(batches)
+    assert read == REVIEWS[:3]
+
+
+def test_batched_extraction_matches_single_review_extraction():
+    single = demo.extract_descriptive_details_from_reviews(REVIEWS, model=ExtractionModel())
+    model = ExtractionModel()
+    batched = demo.extract_descriptive_details_from_reviews(REVIEWS, model=model, batched=True, max_output_tokens=4000)
+    assert batched == single
+    assert len(model.prompts) == 1
+
+
+def test_reviews_missing_from_the_batched_reply_are_extracted_alone():
+    model = ExtractionModel(skip=["green wool"])
+    failures = []
+    details = demo.extract_descriptive_details_from_reviews(REVIEWS, model=model, batched=True, max_output_tokens=4000,
+                                                            on_parse_failure=failures.append)
+    assert details[2] == {"color": "green", "material": "wool"}
+    assert len(model.prompts) == 2
+    assert failures == [1]
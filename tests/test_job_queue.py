@@ -0,0 +1,91 @@
+import os
+import threading
+
+import pytest
+
+from job_queue import JobQueue, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(os.path.join(tmp_path, "jobs.sqlite"), max_attempts=2)
+
+
+def test_jobs_are_claimed_oldest_first(queue):
+    first = queue.submit({"n": 1})
+    second = queue.submit({"n": 2})
+    assert queue.claim("worker-0") == (first, {"n": 1})
+    assert queue.claim("worker-1") == (second, {"n": 2})
+    assert queue.claim("worker-0") is None
+    assert queue.status(first)["status"] == RUNNING
+    assert queue.status(first)["attempts"] == 1
+
+
+def test_completed_and_failed_jobs(queue):
+    done = queue.submit({})
+    failed = queue.submit({})
+    queue.claim("worker-0")
+    queue.claim("worker-0")
+    queue.complete(done, {"merged": [1, 2]})
+    queue.fail(failed, ValueError("bad input"))
+    assert queue.result(done) == {"merged": [1, 2]}
+    assert queue.result(failed) is None
+    assert queue.status(failed)["error"] == "bad input"
+    assert queue.counts() == {QUEUED: 0, RUNNING: 0, DONE: 1, FAILED: 1}
+    assert queue.status("no such job") is None
+
+
+def test_concurrent_workers_never_claim_the_same_job(tmp_path):
+    path = os.path.join(tmp_path, "jobs.sqlite")
+    submitted = [JobQueue(path).submit({"n": n}) for n in range(50)]
+    claimed = []
+
+    def work(worker):
+        # every worker has its own connection, as the worker processes do
+        queue = JobQueue(path)
+        while True:
+            job = queue.claim(worker)
+            if job is None:
+                return
+            claimed.append(job[0])
+
+    threads = [threading.Thread(target=work, args=(f"worker-{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(submitted)
+
+
+def test_requeue_only_touches_the_given_worker(queue):
+    first = queue.submit({})
+    second = queue.submit({})
+    queue.claim("worker-0")
+    queue.claim("worker-1")
+    assert queue.requeue("worker-0") == 1
+    assert queue.status(first)["status"] == QUEUED
+    assert queue.status(second)["status"] == RUNNING
+    assert queue.claim("worker-2")[0] == first
+    assert queue.status(first)["attempts"] == 2
+
+
+def test_a_job_that_keeps_stopping_its_worker_fails(queue):
+    job = queue.submit({})
+    queue.claim("worker-0")
+    assert queue.requeue() == 1
+    queue.claim("worker-0")
+    assert queue.requeue() == 0
+    status = queue.status(job)
+    assert status["status"] == FAILED
+    assert status["attempts"] == 2
+    assert queue.claim("worker-0") is None
+
+
+def test_a_shutdown_does_not_count_as_an_attempt(queue):
+    job = queue.submit({})
+    for _ in range(3):
+        queue.claim("worker-0")
+        assert queue.requeue(count_attempt=False) == 1
+    status = queue.status(job)
+    assert status["status"] == QUEUED
+    assert status["attempts"] == 0
@@ -0,0 +1,93 @@
+import os
+import time
+
+import pytest
+
+from llm_cache import CachedModel, CachedResponse, ResponseCache, invalidate_cached_response
+
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt_parts, **kwargs):
+        self.calls += 1
+        text = f"reply {self.calls}"
+        if kwargs.get("stream"):
+            return [CachedResponse(text[:3]), CachedResponse(text[3:])]
+        return CachedResponse(text)
+
+
+class Wrapper:
+    def __init__(self, model):
+        self.model = model
+
+    def generate_content(self, prompt_parts, **kwargs):
+        return self.model.generate_content(prompt_parts, **kwargs)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(os.path.join(tmp_path, "responses.sqlite"))
+
+
+def test_keys_depend_on_everything_that_changes_the_reply():
+    key = ResponseCache.make_key("model", {"temperature": 1.0}, ["prompt"])
+    assert key == ResponseCache.make_key("model", {"temperature": 1.0}, ["prompt"])
+    assert key == ResponseCache.make_key("model", {"temperature": 1.0}, ["prompt"], {"stream": True})
+    assert key != ResponseCache.make_key("other", {"temperature": 1.0}, ["prompt"])
+    assert key != ResponseCache.make_key("model", {"temperature": 0.5}, ["prompt"])
+    assert key != ResponseCache.make_key("model", {"temperature": 1.0}, ["prompt", "more"])
+    assert key != ResponseCache.make_key("model", {"temperature": 1.0}, ["prompt"], {"safety_settings": "none"})
+
+
+def test_repeated_calls_are_answered_from_the_cache(cache):
+    model = CountingModel()
+    cached = CachedModel(model, cache, "model", {})
+    assert cached.generate_content(["prompt"]).text == "reply 1"
+    assert cached.generate_content(["prompt"]).text == "reply 1"
+    # a stored reply also answers a stream, as one chunk
+    assert [chunk.text for chunk in cached.generate_content(["prompt"], stream=True)] == ["reply 1"]
+    assert model.calls == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_only_fully_consumed_streams_are_stored(cache):
+    model = CountingModel()
+    cached = CachedModel(model, cache, "model", {})
+    next(iter(cached.generate_content(["prompt"], stream=True)))
+    assert "".join(chunk.text for chunk in cached.generate_content(["prompt"], stream=True)) == "reply 2"
+    assert cached.generate_content(["prompt"]).text == "reply 2"
+    assert model.calls == 2
+
+
+def test_calls_without_the_cache_are_neither_answered_nor_stored(cache):
+    model = CountingModel()
+    cached = CachedModel(model, cache, "model", {})
+    cached.generate_content(["prompt"])
+    assert cached.generate_content(["prompt"], cache=False).text == "reply 2"
+    assert cached.generate_content(["prompt"]).text == "reply 1"
+
+
+def test_invalidated_replies_are_asked_again(cache):
+    model = CountingModel()
+    wrapped = Wrapper(CachedModel(model, cache, "model", {}))
+    wrapped.generate_content(["prompt"])
+    invalidate_cached_response(wrapped, ["prompt"])
+    assert wrapped.generate_content(["prompt"]).text == "reply 2"
+    # a model without a cache has nothing to drop
+    invalidate_cached_response(Wrapper(model), ["prompt"])
+
+
+def test_expired_and_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(os.path.join(tmp_path, "responses.sqlite"), max_bytes=10, max_age=None)
+    cache.put("old", "123456")
+    time.sleep(0.01)
+    cache.put("new", "123456")
+    cache.evict()
+    assert cache.get("old") is None
+    assert cache.get("new") == "123456"
+
+    cache.max_age = 0
+    time.sleep(0.01)
+    assert cache.get("new") is None
@@ -0,0 +1,51 @@
+import warnings
+
+from prematch import DescriptionIndex, prematch_pair, prematch_reviews, table_cell
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import demo
+    from benchmark import MockModel
+
+
+DESCRIPTION = "Slim laptop with 16GB RAM, 512GB SSD storage. The colour is silver.\nNot waterproof."
+
+
+def decide(attribute, value):
+    return prematch_pair(DescriptionIndex(DESCRIPTION), attribute, value)
+
+
+def test_values_found_next_to_their_attribute_match():
+    assert decide("color", "silver") == "matches >> The colour is silver."
+    assert decide("storage", "512 GB") == "matches >> Slim laptop with 16GB RAM, 512GB SSD storage."
+
+
+def test_a_value_found_under_another_attribute_goes_to_the_model():
+    assert decide("ram", "512gb") is None
+
+
+def test_pairs_the_description_never_mentions_are_missing():
+    assert decide("battery life", "10 hours") == "missing"
+
+
+def test_negated_and_opinion_values_go_to_the_model():
+    assert decide("waterproof", "waterproof") is None
+    assert decide("color", "beautiful silver") is None
+
+
+def test_reviews_are_split_into_local_rows_and_pairs_for_the_model():
+    ambiguous, rows = prematch_reviews(DESCRIPTION, [{"color": "silver", "ram": "8gb"}, {"battery | life": "10 hours"}])
+    assert ambiguous == [{"ram": "8gb"}, {}]
+    assert rows == [[["color", "silver", "matches >> The colour is silver."]], [["battery / life", "10 hours", "missing"]]]
+    assert table_cell(" two\n lines | here ") == "two lines / here"
+
+
+def test_prematched_comparison_keeps_every_review_and_pair():
+    reviews = [{"color": "silver"}, {"ram": "8gb", "battery life": "10 hours"}, {"size": "slim"}]
+    model = MockModel(median=0.0)
+    tables = demo.run_compare(DESCRIPTION, reviews, model=model, max_output_tokens=4000, prematch=True)
+    split = demo.split_review_tables(tables)
+    assert sorted(split) == [1, 2, 3]
+    assert [len(split[number].split("\n")) - 1 for number in sorted(split)] == [len(review) for review in reviews]
+    # only the reviews with ambiguous pairs were sent
+    assert model.calls == 1
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from ratelimit import CircuitBreaker, CircuitOpenError, RateLimiter, ResilientModel, TokenBucket
+
+
+class ServerError(Exception):
+    code = 500
+
+
+class Response:
+    def __init__(self, text, total_token_count=None):
+        self.text = text
+        self.usage_metadata = type("Usage", (), {"total_token_count": total_token_count})()
+
+
+# fails the first `failures` calls with a 500, then answers
+class FlakyModel:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt_parts, **kwargs):
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise ServerError("500 internal error")
+        return Response("ok")
+
+
+def test_token_bucket_caps_and_releases():
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+    assert bucket.acquire(25) == 10
+    bucket.release(4)
+    assert bucket.tokens == pytest.approx(4, abs=0.5)
+
+
+def test_unused_reserved_tokens_are_given_back():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    model = ResilientModel(type("Model", (), {"generate_content": lambda self, parts: Response("ok", 10)})(),
+                           limiter, max_output_tokens=500)
+    model.generate_content("x" * 400)
+    assert limiter.tokens.tokens == pytest.approx(990, abs=1)
+
+
+# every worker's first attempt failing at once used to open the circuit and fail the stage
+def test_one_round_of_concurrent_failures_is_retried():
+    model = ResilientModel(FlakyModel(failures=8), breaker=CircuitBreaker(failure_threshold=8), base_delay=0.01)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(model.generate_content("prompt").text))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["ok"] * 8
+    assert model.breaker.opened_at is None
+
+
+def test_an_open_circuit_is_waited_out():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    breaker.record_failure()
+    model = ResilientModel(FlakyModel(failures=0), breaker=breaker)
+    started = time.monotonic()
+    assert model.generate_content("prompt").text == "ok"
+    assert time.monotonic() - started >= 0.15
+    assert breaker.opened_at is None
+
+
+def test_callers_wait_for_the_trial_call():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    breaker.before_call()
+    waiter = threading.Thread(target=breaker.before_call)
+    waiter.start()
+    time.sleep(0.05)
+    assert waiter.is_alive()
+    breaker.record_success()
+    waiter.join(1)
+    assert not waiter.is_alive()
+
+
+def test_a_failed_trial_call_raises_for_the_waiting_callers():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    breaker.before_call()
+    errors = []
+
+    def wait():
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            errors.append(e)
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.05)
+    breaker.record_failure(count=False)
+    waiter.join(1)
+    assert len(errors) == 1
+
+
+def test_a_failing_service_raises_after_max_attempts():
+    model = ResilientModel(FlakyModel(failures=100), breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.05),
+                           max_attempts=4, base_delay=0.01)
+    with pytest.raises((ServerError, CircuitOpenError)):
+        model.generate_content("prompt")
+    assert model.model.calls <= 4
@@ -0,0 +1,77 @@
+import io
+import json
+
+import pytest
+
+from review_reader import iter_reviews
+
+
+REVIEWS = ["Red cotton shirt, size large.", "Has a [bracket] and a {brace}", 'Quotes \\" and "escaped" text',
+           "Ünïcödé, ✓ and 日本語", "", "The last one, with a comma, and a ] at the end ]"]
+
+
+def json_array(entries):
+    return json.dumps([{"review": review} for review in entries], ensure_ascii=False, indent=1)
+
+
+def json_lines(entries):
+    return "\n".join(json.dumps({"review": review}, ensure_ascii=False) for review in entries) + "\n"
+
+
+# every chunk size up to the whole input moves the chunk boundaries through every entry
+@pytest.mark.parametrize("encode", [json_array, json_lines])
+def test_chunk_boundaries_do_not_change_the_reviews(encode):
+    text = encode(REVIEWS)
+    for chunk_size in range(1, len(text) + 2):
+        errors = []
+        assert list(iter_reviews(text, errors, chunk_size=chunk_size)) == REVIEWS, chunk_size
+        assert errors == []
+
+
+def test_reads_bytes_and_binary_files():
+    data = json_array(REVIEWS).encode("utf-8")
+    assert list(iter_reviews(data, chunk_size=7)) == REVIEWS
+    # the file is read again on every rerun of the demo, so it is left open and rewound
+    upload = io.BytesIO(data)
+    assert list(iter_reviews(upload, chunk_size=7)) == REVIEWS
+    assert list(iter_reviews(upload, chunk_size=7)) == REVIEWS
+
+
+def test_plain_strings_are_reviews():
+    assert list(iter_reviews(json.dumps(["one", "two"]), chunk_size=3)) == ["one", "two"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+def test_malformed_array_entries_are_skipped(chunk_size):
+    text = '[{"review": "good"}, {"review": broken}, {"text": "no review key"}, 42, {"review": "also good"}]'
+    errors = []
+    assert list(iter_reviews(text, errors, chunk_size=chunk_size)) == ["good", "also good"]
+    assert [error["Entry"] for error in errors] == [2, 3, 4]
+
+
+# skipping a malformed entry used to jump to the next object and drop the entries before it
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+def test_entries_after_a_malformed_entry_keep_their_numbers(chunk_size):
+    text = '[{"review": "a" "x"}, 5, "plain", {"review": "ok", "tags": ["a,]", {"b": "}"}]}, {"review": [1,} ]}, 7]'
+    errors = []
+    assert list(iter_reviews(text, errors, chunk_size=chunk_size)) == ["plain", "ok"]
+    assert [error["Entry"] for error in errors] == [1, 2, 5, 6]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 16])
+def test_malformed_lines_are_skipped(chunk_size):
+    text = '{"review": "good"}\nnot json\n\n{"review": 3}\n{"review": "also good"}'
+    errors = []
+    assert list(iter_reviews(text, errors, chunk_size=chunk_size)) == ["good", "also good"]
+    assert [error["Entry"] for error in errors] == [2, 4]
+
+
+def test_unterminated_array_is_reported():
+    errors = []
+    assert list(iter_reviews('[{"review": "good"}, {"review": "cut', errors, chunk_size=4)) == ["good"]
+    assert len(errors) == 1
+
+
+def test_empty_input_has_no_reviews():
+    assert list(iter_reviews("   \n ")) == []
+    assert list(iter_reviews("[]")) == []
@@ -0,0 +1,198 @@
+import random
+import warnings
+
+import pandas as pd
+import pytest
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    import demo
+
+
+# merge_tables, pretty_print_review_tables and split_tables as they were before they were
+# vectorized, the current versions must give the same tables
+
+
+def baseline_merge_tables(review_tables):
+    tables = review_tables.split("\n\n")
+    all_merged_data = []
+    error_log = []
+    for i, table in enumerate(tables):
+        rows = table.split("\n")
+        for row in rows:
+            try:
+                if "Output table" in row or "Attribute" in row or "---" in row:
+                    continue
+                row = row.strip()
+                if row == "":
+                    continue
+                row_data = row.split("|")
+                row_data = [data.strip() for data in row_data]
+                row_data.append(str(i))
+
+                if ">>" in row_data[2]:
+                    reason = row_data[2].split(">>")[1].strip()
+                else:
+                    reason = "no reason available"
+                row_data.append(reason)
+
+                if "match" in row_data[2] and "partially match" not in row_data[2]:
+                    row_data[2] = "matches"
+                elif "partially match" in row_data[2]:
+                    row_data[2] = "partially matches"
+                elif "contradict" in row_data[2]:
+                    row_data[2] = "contradicts"
+                elif "opinion" in row_data[2]:
+                    row_data[2] = "opinion"
+                elif "missing" in row_data[2]:
+                    row_data[2] = "missing"
+                else:
+                    row_data[2] = "unknown"
+            except Exception as e:
+                error_log.append(f"Error in row {row_data}: {str(e)}")
+                continue
+
+            if len(row_data) == 5:
+                all_merged_data.append(row_data)
+            else:
+                error_log.append(f"Error in row {row_data}: Incorrect number of columns")
+
+    merged_table = pd.DataFrame(all_merged_data, columns=[
+                                "Attribute", "Value", "Description", "Review number", "Reason"])
+    merged = []
+    for status in ["missing", "contradicts", "partially matches"]:
+        table = merged_table[merged_table["Description"] == status].sort_values(by="Attribute")
+        table = table.drop(columns=["Description", "Reason"]).dropna()
+        merged.append(table.groupby('Attribute').agg(
+            {'Value': ', '.join, 'Review number': ', '.join}).reset_index())
+    return merged + [error_log]
+
+
+def baseline_pretty_print_review_tables(review_tables):
+    pretty_tables = []
+    for table in review_tables.split("\n\n"):
+        pretty_table = []
+        for row in table.split("\n"):
+            if "Output table" in row or "Attribute" in row or "---" in row:
+                continue
+            row_data = [data.strip() for data in row.split("|")]
+            if len(row_data) == 3:
+                pretty_table.append(row_data)
+        pretty_tables.append(pd.DataFrame(pretty_table, columns=["Attribute", "Value", "Description"]))
+    return pretty_tables
+
+
+def baseline_split_tables(table, category_dict):
+    for category, attributes in category_dict.items():
+        for attribute in attributes:
+            if attribute in table['Attribute'].values:
+                table.loc[table['Attribute'] == attribute, 'Category'] = category
+
+    split_tables = {}
+    for category in category_dict.keys():
+        split_tables[category] = table[table['Category'] == category].drop(columns=['Category'])
+    return split_tables
+
+
+DESCRIPTIONS = ["missing", "matches >> color: red", "partially matches >> a >> b", "contradiction >> size: small",
+                "expresses opinion", "weird", "mismatch", "Matches"]
+
+
+def random_review_tables(count, seed):
+    generator = random.Random(seed)
+    blocks = []
+    for number in range(1, count + 1):
+        rows = [f"Output table for Review {number}", "Attribute | Value | Description", "---|---|---"]
+        for k in range(generator.randint(0, 5)):
+            kind = generator.random()
+            if kind < 0.05:
+                rows.append("bad row")
+            elif kind < 0.08:
+                rows.append("a|b|c|d")
+            elif kind < 0.1:
+                rows.append("   ")
+            else:
+                rows.append(f" attr{generator.randint(0, 9)} | v{k} | {generator.choice(DESCRIPTIONS)} ")
+        blocks.append("\n".join(rows))
+    return "\n\n".join(blocks) + "\n"
+
+
+@pytest.mark.parametrize("count", [0, 1, 5, 60])
+def test_merge_tables_matches_baseline(count):
+    review_tables = random_review_tables(count, seed=count)
+    *expected, expected_errors = baseline_merge_tables(review_tables)
+    *merged, errors = demo.merge_tables(review_tables)
+
+    for expected_table, table in zip(expected, merged):
+        assert list(table.columns) == list(expected_table.columns)
+        assert list(table["Attribute"]) == list(expected_table["Attribute"])
+        # the order of the values within an attribute was never stable
+        for column in ["Value", "Review number"]:
+            assert ([sorted(values.split(", ")) for values in table[column]]
+                    == [sorted(values.split(", ")) for values in expected_table[column]])
+    assert len(errors) == len(expected_errors)
+
+
+@pytest.mark.parametrize("count", [0, 1, 5, 60])
+def test_pretty_print_matches_baseline(count):
+    review_tables = random_review_tables(count, seed=count + 100)
+    expected = baseline_pretty_print_review_tables(review_tables)
+    tables = demo.pretty_print_review_tables(demo.parse_review_tables(review_tables))
+    assert len(tables) == len(expected)
+    for expected_table, table in zip(expected, tables):
+        assert table.values.tolist() == expected_table.values.tolist()
+
+
+def test_parse_review_tables_classifies_descriptions():
+    review_tables = ("Output table for Review 1\nAttribute | Value | Description\n"
+                     "color | red | matches >> color: red\nsize | large | partially matches >> size: L\n\n"
+                     "Output table for Review 2\nAttribute | Value | Description\n"
+                     "fabric | silk | contradicts >> fabric: cotton\nweight | light | missing\nfeel | soft | expresses opinion")
+    parsed = demo.parse_review_tables(review_tables)
+    assert parsed.table_count == 2
+    assert parsed.error_log == []
+    assert parsed.rows["Table"].tolist() == [0, 0, 1, 1, 1]
+    assert parsed.rows["Status"].tolist() == ["matches", "partially matches", "contradicts", "missing", "opinion"]
+    assert parsed.rows["Reason"].tolist()[:3] == ["color: red", "size: L", "fabric: cotton"]
+
+
+def test_join_review_tables_keeps_missing_reviews_in_place():
+    tables = {1: "Attribute | Value | Description\ncolor | red | missing",
+              3: "Attribute | Value | Description\nsize | large | missing"}
+    review_tables = demo.join_review_tables(tables, 3)
+    assert demo.split_review_tables(review_tables) == {1: tables[1], 2: "", 3: tables[3]}
+
+    missing, _, _, _ = demo.merge_tables(review_tables)
+    assert dict(zip(missing["Attribute"], missing["Review number"])) == {"color": "0", "size": "2"}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_split_tables_matches_baseline(seed):
+    generator = random.Random(seed)
+    attributes = [f"attr{k}" for k in range(8)]
+    table = pd.DataFrame({"Attribute": [generator.choice(attributes) for _ in range(30)],
+                          "Value": [f"v{k}" for k in range(30)],
+                          "Review number": [str(generator.randint(0, 9)) for _ in range(30)]})
+    # the baseline kept only the last category of an attribute, so the categories don't overlap here
+    category_dict = {"first": attributes[:3], "second": attributes[3:5], "third": ["unknown"]}
+
+    expected = baseline_split_tables(table.copy(), category_dict)
+    split = demo.split_tables(table, category_dict, unassigned_category=None)
+    assert list(split) == list(expected)
+    for category in expected:
+        assert split[category].values.tolist() == expected[category].values.tolist()
+    assert "Category" not in table.columns
+
+
+def test_split_tables_collects_unassigned_attributes():
+    table = pd.DataFrame({"Attribute": ["color", "size", "warranty"], "Value": ["red", "large", "2 years"]})
+    split = demo.split_tables(table, {"appearance": "color", "fit": ["size"]})
+    assert list(split) == ["appearance", "fit", demo.UNASSIGNED_CATEGORY]
+    assert split[demo.UNASSIGNED_CATEGORY]["Attribute"].tolist() == ["warranty"]
+
+
+def test_split_tables_puts_an_attribute_in_each_of_its_categories():
+    table = pd.DataFrame({"Attribute": ["color", "size"], "Value": ["red", "large"]})
+    split = demo.split_tables(table, {"appearance": ["color"], "fit": ["size", "color"]}, unassigned_category=None)
+    assert split["appearance"]["Attribute"].tolist() == ["color"]
+    assert sorted(split["fit"]["Attribute"]) == ["color", "size"]